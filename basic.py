@@ -1,13 +1,18 @@
 import sys
-import csv
-import cv2 as cv
-import struct
 import logging
+import threading
+import traceback
 from time import sleep
-from datetime import datetime
 from config import *
 from config import Config as c
-from tabulate import tabulate
+
+# The stage each thread is in, the main loop and the control scheduler
+# would otherwise overwrite each other's
+_local = threading.local()
+
+def currentStage():
+    """Returns the stage the calling thread is in."""
+    return getattr(_local, "stage", None)
 
 def safeCall(func):
     def wrappedFunc(*args, **kwargs):
@@ -18,6 +23,46 @@ def safeCall(func):
             cleanup()
     return wrappedFunc
 
+def supervise(func, *args):
+    """Calls func(*args) with the same guarantee as safeCall: if anything
+    goes wrong the drone is disarmed and the program exits.
+
+    Used once per Update() tick and per initialization phase, so the hot
+    helpers called inside them run unwrapped. The stage of the calling
+    thread is set to the name of func and can be narrowed down by func
+    itself, it is copied to c.failedStage when an exception occurs.
+
+    On any other thread than the main one (the control scheduler) only
+    c.running is cleared: sys.exit() would just end that thread, and
+    cleanup() would close the shared memory under a running Update(). The
+    main loop then stops and runs cleanup() once."""
+    _local.stage = func.__name__
+    try:
+        return func(*args)
+    except Exception as e:
+        stage = currentStage()
+        if c.failedStage is None:
+            c.failedStage = stage
+        print(f"An error occurred in stage {stage} of {func.__name__}(): {e}")
+        logging.debug(traceback.format_exc())
+        if threading.current_thread() is not threading.main_thread():
+            c.running = False
+            if c.scheduler is not None:
+                c.scheduler.stop() # No more ticks until the main thread disarms
+            return
+        cleanup()
+
+def enterStage(stage):
+    """Sets the stage of the calling thread and, if the stages are being
+    timed, charges the time since the last call on this thread to the
+    previous stage. Returns the previous stage of this thread, so a nested
+    stage can hand back to its caller."""
+    previous = currentStage()
+    _local.stage = stage
+    if c.profiler is not None:
+        c.profiler.enter(stage)
+    return previous
+
 def cleanup():
     c.running = False
     c.forward = 0
@@ -26,18 +71,48 @@ def cleanup():
     c.angle = 0
 
     print("Program stopped running")
+
+    # Stop sending commands before disarming
+    if c.scheduler is not None:
+        c.scheduler.stop()
+        logging.debug(f"\tControl scheduler: {c.scheduler.stats()}")
+
     logging.debug("\tDisarming...")
 
-    Disarm()
+    # The shared memory is missing if initialization failed early, and
+    # already closed if cleanup() runs a second time
+    if c.mapFile is not None and not c.mapFile.closed:
+        Disarm()
     c.state = State.Disarmed # Not necessary
 
     logging.debug("\tDrone disarmed")
-    if not c.virtual:
+    if not c.virtual and c.cap is not None:
         logging.debug("\tReleasing camera...")
+        if c.capThread is not None:
+            c.capThread.stop()
         c.cap.release()
-        cv.destroyAllWindows()
         logging.debug("\tCamera released")
 
+    # Each part is let go once stopped, so a second cleanup() skips it
+    if c.vision is not None:
+        c.vision.stop()
+        c.vision = None
+
+    if c.telemetry is not None:
+        c.telemetry.stop()
+        c.telemetry = None
+
+    # Also closes the preview window
+    if c.keys is not None:
+        c.keys.close()
+        c.keys = None
+
+    if c.profiler is not None:
+        print(c.profiler.table())
+        if c.startTime is not None:
+            c.profiler.dump(f"./logs/profile{c.startTime}.json")
+        c.profiler = None
+
     logging.debug("\tClosing shared memory...")
 
     if c.mapFile is not None:
@@ -56,16 +131,16 @@ def handle_signal(signum, frame):
     print(f"\nDetected signal {signum}!\nCleaning up...")
     cleanup()
 
-@safeCall
 def passValues(*inputs):
     """Passes the given values to the shared memory, effectively transmitting them to the drone."""
     if len(inputs) != 16:
         logging.debug("\tError: You must pass 16 values!")
         cleanup()
         return
-    c.values = list(inputs) + [0] * (16 - len(inputs))
-    c.mapFile.seek(0)
-    c.mapFile.write(struct.pack('i'*16, *c.values))
+    c.values = inputs
+    previous = enterStage("passValues")
+    c.channels.write(inputs)
+    enterStage(previous)
 
 @safeCall
 def Arm():
@@ -82,7 +157,6 @@ def Disarm():
     passValues(0, 0, 0, -32768, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
     c.state = State.Disarmed
 
-@safeCall
 def log(*strings):
     """Print debug info."""
     strings = [str(element) for element in strings]
@@ -90,51 +164,8 @@ def log(*strings):
         c.debugInfo += string
     c.debugInfo += "\n"
 
-@safeCall
 def printDebugInfo():
-    """Prints debug information when the -v flag is passed to the program."""
-    from conversions import intToCRSF, intToDegPerSec
-    headers = ["States", "", "CRSF", "int16", "Angle", "", "Accelerations"]
-    data = [
-        {"State": c.state.name,       "1": "Yaw",      "CRSF": intToCRSF(c.yaw),   "int16": c.yaw,      "Angle": round(intToDegPerSec(c.w_y), 4), "2": "x:", "Accelerations": c.a_x},
-        {"State": c.flyingState.name, "1": "Pitch",    "CRSF": intToCRSF(c.pitch), "int16": c.pitch,    "Angle": round(c.Theta, 4),               "2": "y:", "Accelerations": c.a_y},
-        {"State": "",                 "1": "Roll",     "CRSF": intToCRSF(c.roll),  "int16": c.roll,     "Angle": round(c.Phi, 4),                 "2": "z:", "Accelerations": c.a_z},
-        {"State": "",                 "1": "Throttle", "CRSF": c.throttleCRSF,     "int16": c.throttle, "Angle": round(c.angle, 4),               "2": "w:", "Accelerations": c.w_y},
-    ]
-
-    table_data = [[item["State"], item["1"], item["CRSF"], item["int16"], item["Angle"], item["2"], item["Accelerations"]] for item in data]
-
-    print("\033c", end="")
-
-    print(tabulate(table_data, headers=headers, tablefmt="fancy_grid", numalign="left", stralign="right"))
-
-    print(c.debugInfo)
-
-    headers = ["Timestamp", "State", "Flying State", "Yaw int16", "Pitch int16", "Pitch Angle", "Roll int16", "Roll Angle", "Throttle int16", "Acc X", "Acc Y", "Acc Z", "W Y", "Thrust"]
-    data = [
-        datetime.now().isoformat(),
-        c.state.name,
-        c.flyingState.name,
-        c.yaw,
-        c.pitch,
-        round(c.Theta, 4),
-        c.roll,
-        round(c.Phi, 4),
-        c.throttle,
-        c.a_x,
-        c.a_y,
-        c.a_z,
-        c.w_y,
-        c.Thrust
-    ]
-
-    writtenHeaders = True
-    if c.startTime is None:
-        c.startTime = datetime.now()
-        writtenHeaders = False
-    with open(f"./logs/log{c.startTime}.csv", "a", newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        if not writtenHeaders:
-            writer.writerow(headers)
-            writtenHeaders = True
-        writer.writerow(data)
+    """Hands the current state to the telemetry thread, which prints the
+    debug table and appends it to the log file."""
+    if c.telemetry is not None:
+        c.telemetry.push()
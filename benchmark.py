@@ -0,0 +1,361 @@
+import os
+import sys
+import json
+import time
+import mmap
+import argparse
+import platform
+import subprocess
+import multiprocessing
+import posix_ipc
+import numpy as np
+import cv2 as cv
+from config import *
+from config import Config as c
+from basic import safeCall, passValues
+from channels import ChannelWriter, ChannelReader, SHM_SIZE
+from conversions import ThrustToRPM, RPMtoThrottleCRSF, CRSFtoInt, degPerSecToInt
+from segmentation import getSegmenter
+from utils import findLargestBlob, findContour, find_contours, getFrame, clamp, remap_range
+from control import control, ZeroThrottle, Hover, flyForward
+from takeoff import CalculateTakeoff, CalculateLanding, Takeoff, Land
+from throttletable import ThrottleTable
+from init import initSharedMemory, initCamera
+from virtcam import VirtualCameraWriter
+
+"""
+Benchmarks of the control and vision hot paths. They need no camera and no
+ELRS bridge: frames are synthetic and /myshm and /myVirtCamMem are replaced
+by uniquely named shared memory segments that are removed afterwards.
+
+    python3 benchmark.py --json results.json
+    python3 benchmark.py --baseline results.json  # Fails on regressions
+"""
+
+
+def syntheticFrame(seed=0, speckles=200):
+    """A 640x480 BGR frame with one large blob of every segmented color and
+    `speckles` small ones scattered around, on a gray background."""
+    rng = np.random.default_rng(seed)
+    image = np.full((CAM_HEIGHT, CAM_WIDTH, 3), 90, dtype=np.uint8)
+    bgr = {}
+    for lower, upper in SEGMENTATION_COLORS:
+        hue = (lower[0] + upper[0]) // 2 if lower[0] <= upper[0] else 0
+        hsv = np.uint8([[[hue, 230, 230]]])
+        bgr[(lower, upper)] = tuple(int(v) for v in cv.cvtColor(hsv, cv.COLOR_HSV2BGR)[0, 0])
+
+    for i, color in enumerate(SEGMENTATION_COLORS):
+        center = (80 + 110 * i, 120 + 60 * (i % 2))
+        cv.circle(image, center, 40, bgr[color], -1)
+    for _ in range(speckles):
+        color = SEGMENTATION_COLORS[rng.integers(len(SEGMENTATION_COLORS))]
+        center = (int(rng.integers(CAM_WIDTH)), int(rng.integers(CAM_HEIGHT)))
+        cv.circle(image, center, int(rng.integers(1, 4)), bgr[color], -1)
+    return image
+
+
+def bench(func, iterations=200, warmup=10, setup=None):
+    """Runs func() and returns its throughput and latency percentiles.
+    setup(), if given, runs untimed before every call."""
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        func()
+    samples = np.empty(iterations, dtype=np.int64)
+    for i in range(iterations):
+        if setup is not None:
+            setup()
+        start = time.perf_counter_ns()
+        func()
+        samples[i] = time.perf_counter_ns() - start
+    return {
+        "ops_per_sec": 1e9 / samples.mean(),
+        "p50_us": np.percentile(samples, 50) / 1e3,
+        "p99_us": np.percentile(samples, 99) / 1e3,
+        "max_us": samples.max() / 1e3,
+    }
+
+
+class configured:
+    """Temporarily sets Config attributes, e.g. with configured(colorLut=True):"""
+
+    def __init__(self, **values):
+        self.values = values
+
+    def __enter__(self):
+        self.saved = {name: getattr(c, name) for name in self.values}
+        for name, value in self.values.items():
+            setattr(c, name, value)
+
+    def __exit__(self, *exc):
+        for name, value in self.saved.items():
+            setattr(c, name, value)
+
+
+def benchBlobBackends(iterations=200):
+    masks = getSegmenter(SEGMENTATION_COLORS).masks(syntheticFrame())
+    results = {}
+    for backend in ("contours", "components"):
+        results[backend] = bench(lambda: [findLargestBlob(mask, color, backend=backend) for color, mask in masks.items()], iterations)
+    return results
+
+
+def benchDetection(iterations=200):
+    """find_contours() and findContour() on one color, like Stabilize(), and
+    findContour() on three colors, like followHoops(), with different
+    detection settings."""
+    image = syntheticFrame()
+    lower, upper = BLUE
+    results = {"find_contours": bench(lambda: find_contours(image, lower, upper), iterations)}
+    with configured(segmenter=None):
+        results["findContour BLUE"] = bench(lambda: findContour(image, BLUE), iterations, setup=c.overlays.clear)
+
+    variants = {
+        "findContour": {},
+        "findContour levels=1": {"detectionLevels": 1},
+        "findContour levels=1 refine": {"detectionLevels": 1, "detectionRefine": True},
+        "findContour components": {"blobBackend": "components"},
+        "findContour color LUT": {"colorLut": True},
+    }
+    for name, settings in variants.items():
+        with configured(segmenter=None, **settings):
+            results[name] = bench(lambda: findContour(image, RED, GREEN, BLUE), iterations, setup=c.overlays.clear)
+    return results
+
+
+def _createSharedMemory(purpose, size):
+    """A uniquely named stand-in for one of the shared memory segments."""
+    name = f"/dronectrl-bench-{purpose}-{os.getpid()}"
+    return name, posix_ipc.SharedMemory(name, posix_ipc.O_CREX, size=size)
+
+
+def benchSharedMemory(iterations=2000):
+    """passValues() through the /myshm stand-in, set up by initSharedMemory(),
+    with every frame changed and with unchanged frames skipped until the
+    heartbeat, and getFrame() from the /myVirtCamMem stand-in."""
+    results = {}
+    name, memory = _createSharedMemory("shm", SHM_SIZE)
+    try:
+        with configured(shmName=name, memory=None, mapFile=None, channels=None, values=None):
+            initSharedMemory()
+            counter = iter(range(1 << 62))
+            results["passValues"] = bench(lambda: passValues(next(counter) & 0xffff, 0, 0, -32768, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0), iterations)
+            results["passValues unchanged"] = bench(lambda: passValues(0, 0, 0, -32768, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0), iterations)
+            c.mapFile.close()
+    finally:
+        memory.close_fd()
+        memory.unlink()
+
+    name = f"/dronectrl-bench-virtcam-{os.getpid()}"
+    with configured(virtual=True, virtCamShmName=name, virtCamMemory=None, virtCamMapFile=None, virtCam=None, image=None, newFrame=True):
+        try:
+            initCamera()
+            # Without the frame header every frame is copied
+            c.virtCamMapFile[:VIRTUAL_IMAGE_SIZE] = np.ascontiguousarray(syntheticFrame()[::-1, :, ::-1]).tobytes()
+            results["getFrame virtual"] = bench(getFrame, iterations)
+            writer = VirtualCameraWriter(c.virtCamMapFile)
+            writer.write(syntheticFrame(), 0.0)
+            results["getFrame virtual unchanged"] = bench(getFrame, iterations)
+            results["getFrame virtual new"] = bench(getFrame, iterations, setup=lambda: writer.write(c.image, writer.seq * 0.01))
+        finally:
+            if c.virtCamMemory is not None:
+                c.virtCamMapFile.close()
+                c.virtCamMemory.close_fd()
+                c.virtCamMemory.unlink()
+    return results
+
+
+def benchControl(iterations=2000):
+    """control() in every state, passing the values through a /myshm
+    stand-in, with and without the throttle lookup table."""
+    CalculateTakeoff(TAKEOFF_HEIGHT, TAKEOFF_TIME)
+    CalculateLanding()
+    states = {
+        "Disarmed": (State.Disarmed, ZeroThrottle),
+        "Grounded": (State.Grounded, ZeroThrottle),
+        "TakingOff": (State.TakingOff, lambda: Takeoff(1)),
+        "Hovering": (State.Flying, Hover),
+        "FlyingForward": (State.Flying, flyForward),
+        "Landing": (State.Landing, lambda: Land(1)),
+    }
+
+    def reset():
+        c.debugInfo = ""
+
+    results = {}
+    name, memory = _createSharedMemory("control", SHM_SIZE)
+    try:
+        with configured(shmName=name, memory=None, mapFile=None, channels=None, values=None, state=c.state,
+                        forward=c.forward, sideways=c.sideways, vertical=c.vertical, angle=c.angle, debugInfo=c.debugInfo):
+            initSharedMemory()
+            for stateName, (state, setpoints) in states.items():
+                c.state = state
+                setpoints()
+                results[stateName] = bench(control, iterations, setup=reset)
+            with configured(throttleTable=ThrottleTable()):
+                results["Hovering throttle LUT"] = bench(control, iterations, setup=reset)
+            c.mapFile.close()
+    finally:
+        memory.close_fd()
+        memory.unlink()
+    return results
+
+
+def benchSafeCall(iterations=200):
+    """The math helpers of one control() tick, called directly and with
+    every call wrapped in safeCall like they used to be."""
+    def hotPath(clamp, remap_range, ThrustToRPM, RPMtoThrottleCRSF, CRSFtoInt, degPerSecToInt):
+        for _ in range(100):
+            remap_range(clamp(320, 0, 640), 0, 640, -60, 60)
+            CRSFtoInt(RPMtoThrottleCRSF(ThrustToRPM(0.8)))
+            degPerSecToInt(12.5)
+            degPerSecToInt(-3.2)
+            degPerSecToInt(0.7)
+
+    funcs = (clamp, remap_range, ThrustToRPM, RPMtoThrottleCRSF, CRSFtoInt, degPerSecToInt)
+    wrapped = tuple(safeCall(func) for func in funcs)
+    return {
+        "unwrapped": bench(lambda: hotPath(*funcs), iterations),
+        "safeCall": bench(lambda: hotPath(*wrapped), iterations),
+    }
+
+
+def _readChannels(buffer, duration, conn):
+    reader = ChannelReader(buffer)
+    reads = torn = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        _, _, values = reader.read()
+        reads += 1
+        if values.count(values[0]) != len(values):
+            torn += 1
+    conn.send((reads, torn, reader.retries))
+
+
+def benchChannels(duration=2):
+    """Writes frames whose 16 channels all hold the same counter as fast as
+    possible while another process reads them. Any frame read back with
+    different values in it is torn."""
+    buffer = mmap.mmap(-1, SHM_SIZE) # Shared with the forked reader
+    writer = ChannelWriter(buffer)
+    ctx = multiprocessing.get_context("fork")
+    parent, child = ctx.Pipe()
+    reader = ctx.Process(target=_readChannels, args=(buffer, duration, child))
+    reader.start()
+
+    value = 0
+    start = time.perf_counter()
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        value = (value + 1) & 0x7fffffff
+        writer.write((value,) * 16)
+    elapsed = time.perf_counter() - start
+
+    reads, torn, retries = parent.recv()
+    reader.join()
+    return {"writes_per_sec": writer.writes / elapsed, "reads": reads, "retries": retries, "torn": torn}
+
+
+BENCHMARKS = {
+    "detection": benchDetection,
+    "blob backends": benchBlobBackends,
+    "shared memory": benchSharedMemory,
+    "control": benchControl,
+    "hot path x100": benchSafeCall,
+}
+
+
+def metadata():
+    """Where the results come from, to tell apart runs of different commits."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def printResults(title, results, file=sys.stdout):
+    print(title, file=file)
+    for name, result in results.items():
+        print(f"{name:>28}: {result['ops_per_sec']:10.1f} ops/s  p50 {result['p50_us']:8.1f} us  p99 {result['p99_us']:8.1f} us", file=file)
+
+
+def compare(results, baseline, threshold, file=sys.stdout):
+    """Prints the p50 latency changes against a baseline run and returns the
+    benchmarks that got more than `threshold` slower."""
+    regressions = []
+    for group, groupResults in results.items():
+        for name, result in groupResults.items():
+            old = baseline.get(group, {}).get(name)
+            if not old or "p50_us" not in result or not old.get("p50_us"):
+                continue
+            change = result["p50_us"] / old["p50_us"] - 1
+            flag = "  REGRESSION" if change > threshold else ""
+            print(f"{group + ' / ' + name:>45}: {old['p50_us']:8.1f} -> {result['p50_us']:8.1f} us ({100 * change:+.1f}%){flag}", file=file)
+            if change > threshold:
+                regressions.append(f"{group} / {name}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the DroneCtrl hot paths, no drone or camera needed.")
+    parser.add_argument("--json", help="write the results as JSON to this file (- for stdout)")
+    parser.add_argument("--only", help="run only these benchmark groups", nargs="+", choices=list(BENCHMARKS) + ["channels"])
+    parser.add_argument("--scale", help="multiply the number of iterations (default: 1)", type=float, default=1)
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", help="p50 slowdown counted as a regression (default: 0.2)", type=float, default=0.2)
+    args = parser.parse_args()
+
+    cv.setRNGSeed(0)
+    log = sys.stderr if args.json == "-" else sys.stdout
+    results = {}
+    for group, func in BENCHMARKS.items():
+        if args.only and group not in args.only:
+            continue
+        iterations = func.__defaults__[0]
+        results[group] = func(max(1, int(iterations * args.scale)))
+        printResults(group.capitalize(), results[group], log)
+
+    if not args.only or "channels" in args.only:
+        channels = benchChannels(2 * args.scale)
+        results["channels"] = {"seqlock": channels}
+        print(f"Channels: {channels['writes_per_sec']:.0f} writes/s, {channels['reads']} reads, "
+              f"{channels['retries']} retries, {channels['torn']} torn frames", file=log)
+
+    if args.json:
+        output = json.dumps({"meta": metadata(), "results": results}, indent=4)
+        if args.json == "-":
+            print(output)
+        else:
+            with open(args.json, "w") as f:
+                f.write(output + "\n")
+
+    failed = False
+    if "channels" in results and results["channels"]["seqlock"]["torn"]:
+        # The seqlock is broken, no timing makes up for that
+        print(f"{results['channels']['seqlock']['torn']} torn channel frames read", file=log)
+        failed = True
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, log)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}", file=log)
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,80 +1,123 @@
-import sys
+import os
+import argparse
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from conversions import *
-
-if len(sys.argv) != 2:
-    print("Usage: python blackbox.py <log.csv>")
-    sys.exit(1)
-
-data = pd.read_csv(sys.argv[1])
-
-plt.figure(figsize=(15, 15))
-
-# "Timestamp", "State", "Flying State", "Yaw int16", "Pitch int16", "Pitch Angle", "Roll int16", "Roll Angle", "Throttle int16", "Acc X", "Acc Y", "Acc Z", "W Y", "Thrust"
-
-plt.subplot(3, 3, 1)
-plt.plot(data["Timestamp"], data["Acc X"], label="Acc X")
-plt.title("Acceleration X")
-plt.ylabel("m/s^2")
-plt.legend()
-plt.xticks([])
-
-plt.subplot(3, 3, 2)
-plt.plot(data["Timestamp"], data["Acc Y"], label="Acc Y")
-plt.title("Acceleration Y")
-plt.ylabel("m/s^2")
-plt.legend()
-plt.xticks([])
-
-plt.subplot(3, 3, 3)
-plt.plot(data["Timestamp"], data["Acc Z"], label="Acc Z")
-plt.title("Acceleration Z")
-plt.ylabel("m/s^2")
-plt.legend()
-plt.xticks([])
-
-plt.subplot(3, 3, 4)
-plt.plot(data["Timestamp"], data["Pitch Angle"], label="Pitch Angle")
-plt.title("Pitch Angle")
-plt.ylabel("Degrees")
-plt.legend()
-plt.xticks([])
-
-plt.subplot(3, 3, 5)
-plt.plot(data["Timestamp"], data["Roll Angle"], label="Roll Angle")
-plt.title("Roll Angle")
-plt.ylabel("Degrees")
-plt.legend()
-plt.xticks([])
-
-plt.subplot(3, 3, 6)
-plt.plot(data["Timestamp"], data["Yaw int16"].apply(lambda x: round(intToDegPerSec(int(x)), 4)), label="Yaw Angle")
-plt.title("Yaw Angle")
-plt.ylabel("Degrees")
-plt.legend()
-plt.xticks([])
-
-plt.subplot(3, 3, 7)
-plt.plot(data["Timestamp"], data["Throttle int16"].apply(lambda x: intToCRSF(int(x))), label="Throttle int16")
-plt.title("Throttle")
-plt.ylabel("CRSF")
-plt.legend()
-plt.xticks([])
-
-plt.subplot(3, 3, 8)
-plt.plot(data["Timestamp"], data["W Y"], label="W Y")
-plt.title("Yaw int16")
-plt.ylabel("int16")
-plt.legend()
-plt.xticks([])
-
-plt.subplot(3, 3, 9)
-plt.plot(data["Timestamp"], data["Thrust"], label="Thrust")
-plt.title("Thrust")
-plt.ylabel("Newtons")
-plt.legend()
-plt.xticks([])
-
-plt.tight_layout()
-plt.show()
\ No newline at end of file
+import matplotlib
+from conversions import intToCRSFArray, intToDegPerSecArray
+from flightlog import openFlightLog, CSV_COLUMNS
+
+# (column, title, y label, transform) of every subplot
+SERIES = [
+    ("Acc X", "Acceleration X", "m/s^2", None),
+    ("Acc Y", "Acceleration Y", "m/s^2", None),
+    ("Acc Z", "Acceleration Z", "m/s^2", None),
+    ("Pitch Angle", "Pitch Angle", "Degrees", None),
+    ("Roll Angle", "Roll Angle", "Degrees", None),
+    ("Yaw int16", "Yaw Angle", "Degrees", lambda x: np.round(intToDegPerSecArray(x), 4)),
+    ("Throttle int16", "Throttle", "CRSF", intToCRSFArray),
+    ("W Y", "Yaw int16", "int16", None),
+    ("Thrust", "Thrust", "Newtons", None),
+]
+
+
+def countRows(path):
+    """Counts the data rows of a CSV file without parsing it."""
+    rows = 0
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            rows += block.count(b"\n")
+    return rows - 1 # Header
+
+
+def readChunks(path, chunkSize):
+    """Yields (seconds, {column: values}) chunks of a CSV or binary (.bbx)
+    flight log, with time in seconds since the first record."""
+    columns = [column for column, _, _, _ in SERIES]
+    if path.endswith(".bbx"):
+        records, _ = openFlightLog(path)
+        if len(records) == 0:
+            return
+        t0 = records["time"][0]
+        for start in range(0, len(records), chunkSize):
+            chunk = records[start:start + chunkSize]
+            yield chunk["time"] - t0, {column: np.asarray(chunk[CSV_COLUMNS[column]], dtype=np.float64) for column in columns}
+    else:
+        t0 = None
+        for chunk in pd.read_csv(path, chunksize=chunkSize, usecols=["Timestamp"] + columns):
+            seconds = pd.to_datetime(chunk["Timestamp"], format="ISO8601").to_numpy().astype("datetime64[ns]").astype(np.int64) / 1e9
+            if t0 is None:
+                t0 = seconds[0]
+            yield seconds - t0, {column: chunk[column].to_numpy(dtype=np.float64) for column in columns}
+
+
+def minMaxBuckets(x, y, bucket):
+    """Downsamples a series by keeping the minimum and the maximum of every
+    `bucket` samples, in time order, so peaks survive the downsampling."""
+    full = len(y) // bucket * bucket
+    indices = []
+    if full:
+        buckets = y[:full].reshape(-1, bucket)
+        starts = np.arange(0, full, bucket)
+        low = starts + buckets.argmin(axis=1)
+        high = starts + buckets.argmax(axis=1)
+        indices.append(np.sort(np.stack((low, high), axis=1), axis=1).ravel())
+    if full < len(y):
+        tail = y[full:]
+        indices.append(np.sort([full + tail.argmin(), full + tail.argmax()]))
+    indices = np.concatenate(indices)
+    return x[indices], y[indices]
+
+
+def loadDownsampled(path, points, chunkSize):
+    """Streams a flight log and returns {column: (seconds, values)} with
+    about `points` points per series."""
+    rows = len(openFlightLog(path)[0]) if path.endswith(".bbx") else countRows(path)
+    bucket = max(1, -(-rows // max(1, points // 2)))
+    # Whole buckets per chunk, so that no bucket spans two chunks
+    chunkSize = bucket * max(1, chunkSize // bucket)
+
+    parts = {column: ([], []) for column, _, _, _ in SERIES}
+    for seconds, chunk in readChunks(path, chunkSize):
+        for column, _, _, transform in SERIES:
+            values = chunk[column] if transform is None else transform(chunk[column])
+            x, y = minMaxBuckets(seconds, values, bucket)
+            parts[column][0].append(x)
+            parts[column][1].append(y)
+
+    return {column: (np.concatenate(x) if x else np.zeros(0), np.concatenate(y) if y else np.zeros(0))
+            for column, (x, y) in parts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plots a DroneCtrl flight log.")
+    parser.add_argument("log", help="CSV or binary (.bbx) flight log")
+    parser.add_argument("--points", help="points plotted per series (default: 4000)", type=int, default=4000)
+    parser.add_argument("--chunk-size", help="rows read at a time (default: 100000)", type=int, default=100000)
+    parser.add_argument("-o", "--output", help="save the figure to this file instead of showing it")
+    args = parser.parse_args()
+
+    if args.output:
+        matplotlib.use("Agg") # Headless
+    import matplotlib.pyplot as plt
+
+    data = loadDownsampled(args.log, args.points, args.chunk_size)
+
+    plt.figure(figsize=(15, 15))
+    plt.suptitle(os.path.basename(args.log))
+
+    for i, (column, title, ylabel, _) in enumerate(SERIES):
+        plt.subplot(3, 3, i + 1)
+        plt.plot(*data[column], label=column)
+        plt.title(title)
+        plt.xlabel("s")
+        plt.ylabel(ylabel)
+        plt.legend()
+
+    plt.tight_layout()
+    if args.output:
+        plt.savefig(args.output)
+    else:
+        plt.show()
+
+if __name__ == "__main__":
+    main()
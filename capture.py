@@ -0,0 +1,84 @@
+import threading
+import logging
+import time
+import numpy as np
+
+
+class CaptureThread(threading.Thread):
+    """Continuously grabs frames from a cv.VideoCapture in the background
+    so that the control loop never waits on the camera driver.
+
+    Frames are retrieved into a back buffer which is then swapped with the
+    published slot. read() swaps the published slot with the buffer owned
+    by the caller, so neither side ever copies a frame and neither side
+    writes into a buffer the other one is using."""
+
+    def __init__(self, cap, shape):
+        super().__init__(name="CaptureThread", daemon=True)
+        self.cap = cap
+        self.running = True
+        self.lock = threading.Lock()
+        self.newFrame = threading.Event()
+
+        self._back = np.zeros(shape, dtype=np.uint8)
+        self._slot = np.zeros(shape, dtype=np.uint8)
+        self._front = np.zeros(shape, dtype=np.uint8)
+
+        self._slotTime = 0.0
+        self._slotSeq = 0
+        self._fresh = False
+
+        self.frameTime = 0.0 # Capture time of the frame returned by read()
+        self.frameSeq = 0 # Sequence number of the frame returned by read()
+        self.dropped = 0 # Frames that were overwritten before being read
+        self.failed = False
+
+    def run(self):
+        logging.debug("\tCapture thread started")
+        seq = 0
+        while self.running:
+            if not self.cap.grab():
+                self.failed = True
+                break
+            timestamp = time.perf_counter()
+
+            ret, frame = self.cap.retrieve(self._back)
+            if not ret:
+                self.failed = True
+                break
+            seq += 1
+
+            with self.lock:
+                if self._fresh:
+                    self.dropped += 1
+                self._back, self._slot = self._slot, frame
+                self._slotTime = timestamp
+                self._slotSeq = seq
+                self._fresh = True
+            self.newFrame.set()
+        self.newFrame.set()
+        logging.debug("\tCapture thread stopped")
+
+    def read(self, timeout=0):
+        """Returns (ret, frame, timestamp, dropped) for the newest frame.
+        If no new frame has arrived since the last call, the previous frame
+        is returned again. `timeout` is only meant for the first frame,
+        the control loop should always call this with the default of 0."""
+        if timeout and not self._fresh:
+            self.newFrame.wait(timeout)
+
+        with self.lock:
+            if self._fresh:
+                self._front, self._slot = self._slot, self._front
+                self.frameTime = self._slotTime
+                self.frameSeq = self._slotSeq
+                self._fresh = False
+            self.newFrame.clear()
+
+        ret = self.frameSeq > 0 and not self.failed
+        return ret, self._front, self.frameTime, self.dropped
+
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join(1)
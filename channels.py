@@ -0,0 +1,71 @@
+import struct
+import time
+from config import *
+
+CHANNELS = struct.Struct("16i")
+# Sequence number and monotonic timestamp, right after the channels so that
+# a bridge which only reads the first 64 bytes keeps working
+HEADER = struct.Struct("Qd")
+HEADER_OFFSET = CHANNELS.size
+SHM_SIZE = HEADER_OFFSET + HEADER.size
+
+
+class ChannelWriter:
+    """Writes the 16 channels to the shared memory read by the ELRS bridge.
+
+    Each write is guarded by a seqlock: the sequence number is odd while a
+    frame is being written and even once it is complete, so a reader that
+    sees the same even number before and after reading has a whole frame.
+    Writes of unchanged values are skipped unless CHANNEL_HEARTBEAT seconds
+    have passed since the last one. If the mapping is too small for the
+    header (an older bridge), only the channels are written."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.seqlock = len(buffer) >= SHM_SIZE
+        self.seq = 0
+        self.last = None
+        self.lastWrite = 0.0
+        self.writes = 0
+        self.skipped = 0
+
+    def write(self, values):
+        """Writes the channels, returns False if the write was skipped."""
+        now = time.monotonic()
+        if values == self.last and now - self.lastWrite < CHANNEL_HEARTBEAT:
+            self.skipped += 1
+            return False
+
+        if self.seqlock:
+            self.seq += 1
+            HEADER.pack_into(self.buffer, HEADER_OFFSET, self.seq, self.lastWrite)
+            CHANNELS.pack_into(self.buffer, 0, *values)
+            self.seq += 1
+            HEADER.pack_into(self.buffer, HEADER_OFFSET, self.seq, now)
+        else:
+            CHANNELS.pack_into(self.buffer, 0, *values)
+
+        self.last = values
+        self.lastWrite = now
+        self.writes += 1
+        return True
+
+
+class ChannelReader:
+    """Reads frames written by a ChannelWriter, the same way the bridge
+    should. Used to check the writer without the bridge."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.retries = 0
+
+    def read(self):
+        """Returns (seq, timestamp, values) of the last complete frame."""
+        while True:
+            seq, _ = HEADER.unpack_from(self.buffer, HEADER_OFFSET)
+            if seq & 1 == 0:
+                values = CHANNELS.unpack_from(self.buffer, 0)
+                seq2, timestamp = HEADER.unpack_from(self.buffer, HEADER_OFFSET)
+                if seq2 == seq:
+                    return seq, timestamp, values
+            self.retries += 1
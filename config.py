@@ -1,4 +1,5 @@
 import signal
+import threading
 from enum import IntEnum
 from dataclasses import dataclass
 
@@ -46,7 +47,78 @@ VIRTUAL_IMAGE_SIZE_X = 640
 VIRTUAL_IMAGE_SIZE_Y = 480
 VIRTUAL_IMAGE_SIZE_Z = 3
 
+VIRTUAL_CAMERA_RETRIES = 3 # Attempts to copy a frame that is being written, see virtcam.py
+VIRTUAL_CAMERA_RETRY_DELAY = 0.0005 # s
+
+CHANNELS_SHM_NAME = "/myshm" # Shared memory the ELRS bridge reads the channels from
+VIRTUAL_CAMERA_SHM_NAME = "/myVirtCamMem" # Shared memory the simulator writes the frames to
+
+SIM_CLOCK = False # Take c.dt from the simulation time of the virtual camera frames (also --sim-clock)
+SIM_CLOCK_FRAME_WAIT = 0.1 # s, with the simulation clock Update() waits this long for a new frame
+
 TIME_TO_ROTATE = 0.5 # s
+
+THROTTLE_LUT = False # Look up the throttle in a precomputed table instead of calculating it, not faster with the analytic motor model (also --throttle-lut)
+THROTTLE_LUT_SIZE = 4096 # Points of the throttle lookup table, the error is logged when it is built
+THROTTLE_LUT_CACHE_DIR = "./cache"
+
+CHANNEL_HEARTBEAT = 0.05 # s, unchanged channels are rewritten at least this often
+
+CONTROL_RATE = 0 # Hz, run control() at this fixed rate on its own thread, 0 runs it once per frame (also --control-rate)
+
+TELEMETRY_INTERVAL = 0.1 # s, how often the debug table is redrawn and the log written
+TELEMETRY_BUFFER_SIZE = 4096 # Records kept in memory until they are written
+BINARY_BLACKBOX = False # Write the flight log in the binary format of flightlog.py (also --blackbox bin)
+PROFILE_STAGES = False # Time each stage of Update(), shown live and dumped to ./logs on exit (also --profile)
+
+HEADLESS = False # No windows and no terminal redraws, keys come from KEY_SOURCE (also --headless)
+KEY_SOURCE = "stdin" # Where the keys come from in headless mode, "stdin" or "mqueue" (also --keys)
+KEY_QUEUE_NAME = "/dronectrl-keys" # POSIX message queue of the "mqueue" key source, see keys.py
+PREVIEW_FPS = 15 # The preview window is redrawn at most this often, 0 for every frame (also --preview-fps)
+
+CAPTURE_THREAD = False # Grab camera frames on a background thread (also --capture-thread)
+FIRST_FRAME_TIMEOUT = 5 # s
+
+COLOR_LUT = False # Classify pixels with a precomputed BGR lookup table (also --color-lut)
+COLOR_LUT_BITS = 6 # Bits per channel of the lookup table, 8 is exact but takes 16 MB
+COLOR_LUT_CACHE_DIR = "./cache"
+
+ROI_TRACKING = False # Only search around the last detection (also --roi)
+ROI_MIN_SIZE = 64 # pixels
+ROI_SCALE = 3 # The search window is this many times the size of the last contour
+ROI_VELOCITY_GAIN = 2 # Extra margin per pixel/frame of target movement
+ROI_MAX_MISSES = 5 # Search the whole frame again after this many misses
+
+VISION_WORKERS = 0 # Run the detection in this many worker processes, 0 runs it in the control loop (also --vision-workers)
+VISION_RING_SIZE = 4 # Frames shared with the vision workers
+VISION_MAX_AGE = 0.5 # s, older vision results are ignored
+VISION_SHM_NAME = "/dronectrl-vision" # The process id is appended
+MAX_CONTOUR_POINTS = 128 # Contour points a vision worker passes back for drawing
+
+DETECTION_LEVELS = 0 # Detect on an image 2**DETECTION_LEVELS times smaller (also --detection-levels)
+DETECTION_REFINE = False # Redo the detection at full resolution around the downscaled result
+
+BLOB_BACKEND = "contours" # "contours" or "components", which is slower except on very speckled masks (also --blob-backend)
+BLOB_DENOISE = 0 # Kernel size of the morphological opening of the "components" backend, 0 to disable
+
+SITL_CAMERA_FPS = 30 # Frames the simulator of sitl.py renders per simulated second (also --fps)
+SITL_PHYSICS_RATE = 240 # Hz of simulated time
+SITL_CAMERA_FOV = 90 # degrees, horizontal
+SITL_HOVER_OFFSET = VERTICAL_ACCELERATION_OFFSET_SIM # The simulated drone hovers when commanded this vertical acceleration, like the simulator it was tuned on
+SITL_ATTITUDE_TIME_CONSTANT = 0.05 # s, how fast the flight controller reaches the commanded angles
+SITL_DRAG = 0.3 # 1/s, linear drag
+SITL_HARD_LANDING_SPEED = 1 # m/s, touchdowns faster than this are counted as hard landings
+SITL_TARGETS = ( # Colored spheres in the world, (color, (x, y, z) in meters, radius in meters), x forward and y left of the start
+    ("BLUE", (3, 0, 0.3), 0.15),
+    ("RED", (4, 1.5, 0.5), 0.2),
+    ("GREEN", (4, -1.5, 0.5), 0.2),
+)
+
+SWEEP_HOVER_TIME = 5 # s, sweep.py hovers this long after the takeoff
+SWEEP_STABILIZE_TIME = 15 # s of stabilized hover before landing
+SWEEP_TARGET = (3, 0.5, 0.4) # The BLUE target of the stabilized hover, in meters like SITL_TARGETS
+SWEEP_SETTLE_BAND = 0.2 # The height is settled within this fraction of TAKEOFF_HEIGHT
+SWEEP_WORKERS = 0 # Processes of a sweep, 0 for one per CPU (also --workers)
 #################################################################
 ################  USER EDITABLE VARIABLES - END  ################
 #################################################################
@@ -76,6 +148,9 @@ RED = ((170, 125, 125), (10, 255, 255))
 GREEN = ((55, 150, 150), (65, 255, 255))
 BLUE = ((100, 110, 110), (115, 255, 255))
 
+# Colors classified together by the segmentation engine (at most 8)
+SEGMENTATION_COLORS = (RED, GREEN, BLUE, PURPLE, ORANGE)
+
 signals_to_handle = [
     signal.SIGINT,
     signal.SIGTERM,
@@ -124,9 +199,11 @@ class Config:
 
     running = True
 
+    shmName = CHANNELS_SHM_NAME
     memory = None
     mapFile = None
     values = None
+    channels = None # channels.ChannelWriter over mapFile
     cap = None
 
     forward = 0 # Move front or back
@@ -137,9 +214,27 @@ class Config:
     height = 0 # The calculated height of the drone
 
     image = None # The current image from the camera
+    segmenter = None # Shared segmentation.Segmenter
+    colorLut = COLOR_LUT
+    roiTracking = ROI_TRACKING
+    roiTrackers = {} # tracking.RoiTracker per tuple of colors
+    visionWorkers = VISION_WORKERS
+    vision = None # vision.VisionPool
+    detectionLevels = DETECTION_LEVELS
+    detectionRefine = DETECTION_REFINE
+    blobBackend = BLOB_BACKEND
+    blobDenoise = BLOB_DENOISE
 
     dt = 0 # The time difference between to Update calls
 
+    throttleLut = THROTTLE_LUT
+    throttleTable = None # throttletable.ThrottleTable
+
+    controlRate = CONTROL_RATE
+    scheduler = None # scheduler.FixedRateScheduler running the control ticks
+    setpoints = (0, 0, -10, 0) # (forward, sideways, vertical, angle) published for the scheduler
+    lock = threading.Lock() # Held by the control ticks and while arming or disarming
+
     #################################################################
     ############  TAKEOFF AND LANDING VARIABLES - START  ############
     #################################################################
@@ -162,7 +257,7 @@ class Config:
     Thrust = 0
     ThrustXZ = 0
     ThrustYZ = 0
-    rpm = 0
+    rpm = 0 # Not calculated when the throttle lookup table is used
     throttle = 0
     throttleCRSF = 0
     Theta = 0
@@ -174,10 +269,33 @@ class Config:
     startTime = None
 
     virtual = False
+    virtCamShmName = VIRTUAL_CAMERA_SHM_NAME
     virtCamMemory = None
     virtCamMapFile = None
+    virtCam = None # virtcam.VirtualCameraReader
+    simClock = SIM_CLOCK
+
+    captureThread = CAPTURE_THREAD
+    capThread = None
+    frameTime = 0 # perf_counter() timestamp of the current frame
+    frameSeq = 0 # Capture thread sequence number of the current frame
+    newFrame = True # False if getFrame() returned the same frame as last time
+    lastTargets = {} # colors -> (Blob, overlays) found in the current frame by findTarget()
+    droppedFrames = 0 # Frames the capture thread overwrote before they were used
 
     debugInfo = None
+    headless = HEADLESS
+    keySource = KEY_SOURCE
+    keys = None # keys.StdinKeys or keys.QueueKeys in headless mode, else c.preview
+    previewFps = PREVIEW_FPS
+    preview = None # preview.PreviewThread, None in headless mode
+    overlays = [] # Blobs found in the current frame, drawn by the preview
+    telemetry = None # telemetry.TelemetryLogger
+    binaryBlackbox = BINARY_BLACKBOX
+    profileStages = PROFILE_STAGES
+    profiler = None # profiler.StageProfiler, None when the stages are not timed
+
+    failedStage = None # The stage that raised the exception which stopped the program
 
     timer = 0
     sd = StabilizedData(0, 0, 0, 0)
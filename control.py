@@ -1,18 +1,17 @@
-from basic import safeCall, log, cleanup, passValues
+import numpy as np
+from basic import log, passValues
 from config import *
 from config import Config as c
 from conversions import *
 from utils import *
-import cv2 as cv
+from tracking import findTarget
 
-@safeCall
 def ZeroThrottle():
     """Sets the throttle to the minimum value, with the drone still armed."""
     c.forward = 0
     c.angle = 0
     c.vertical = -10
 
-@safeCall
 def applyRotation():
     """Rotate the drone to the desired angles."""
     if abs(c.Theta - c.fd.pitch) > 0.1:
@@ -43,45 +42,45 @@ def applyRotation():
         c.yaw = 0
         
 
-@safeCall
-def control():
+def control(setpoints=None):
     """Convert the forward, angle, vertical, and sideways values to pitch,
-    yaw, roll and throttle values and pass them to the drone."""
+    yaw, roll and throttle values and pass them to the drone.
+
+    `setpoints` is a (forward, sideways, vertical, angle) tuple to use
+    instead of the values in Config, which is how the control scheduler
+    passes the latest setpoints published by Update()."""
 
     if c.state == State.Disarmed:
         passValues(0, 0, 0, -32760, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
         log("\tControl() called while disarmed")
         return
 
-    if c.forward > 1 or c.forward < -1:
-        print(f"\tInvalid forward value {c.forward}. Must be between -1 and 1.")
-        cleanup()
-        return
-    elif c.angle > 1 or c.angle < -1:
-        print(f"\tInvalid angle value {c.angle}. Must be between -1 and 1.")
-        cleanup()
-        return
-    elif (c.vertical > 1 or c.vertical < -1) and not c.vertical == -10:
-        print(f"\tInvalid vertical value {c.vertical}. Must be between -1 and 1.")
-        cleanup()
-        return
-    elif c.sideways > 1 or c.sideways < -1:
-        print(f"\tInvalid sideways value {c.sideways}. Must be between -1 and 1.")
-        cleanup()
-        return
-
-    c.a_x = c.forward*MAX_FORWARD_ACCELERATION
-    c.a_y = c.sideways*MAX_SIDEWAYS_ACCELERATION
+    if setpoints is None:
+        forward, sideways, vertical, angle = c.forward, c.sideways, c.vertical, c.angle
+    else:
+        forward, sideways, vertical, angle = setpoints
+
+    if forward > 1 or forward < -1:
+        raise ValueError(f"Invalid forward value {forward}. Must be between -1 and 1.")
+    elif angle > 1 or angle < -1:
+        raise ValueError(f"Invalid angle value {angle}. Must be between -1 and 1.")
+    elif (vertical > 1 or vertical < -1) and not vertical == -10:
+        raise ValueError(f"Invalid vertical value {vertical}. Must be between -1 and 1.")
+    elif sideways > 1 or sideways < -1:
+        raise ValueError(f"Invalid sideways value {sideways}. Must be between -1 and 1.")
+
+    c.a_x = forward*MAX_FORWARD_ACCELERATION
+    c.a_y = sideways*MAX_SIDEWAYS_ACCELERATION
     if c.virtual:
-        c.a_z = (c.vertical+VERTICAL_ACCELERATION_OFFSET_SIM)*MAX_VERTICAL_ACCELERATION
+        c.a_z = (vertical+VERTICAL_ACCELERATION_OFFSET_SIM)*MAX_VERTICAL_ACCELERATION
     else:
-        c.a_z = (c.vertical+VERTICAL_ACCELERATION_OFFSET)*MAX_VERTICAL_ACCELERATION
-    c.w_y = c.angle*MAX_ANGULAR_ACCELERATION
+        c.a_z = (vertical+VERTICAL_ACCELERATION_OFFSET)*MAX_VERTICAL_ACCELERATION
+    c.w_y = angle*MAX_ANGULAR_ACCELERATION
 
     c.Theta = 0
     c.Phi = 0
 
-    if c.vertical == -10:
+    if vertical == -10:
         c.Thrust = 0
         c.Theta = 0
         c.rpm = 0
@@ -97,9 +96,12 @@ def control():
 
         c.Thrust = MASS * math.sqrt(c.a_x**2 + c.a_y**2 + (c.a_z+G)**2)
 
-        c.rpm = ThrustToRPM(c.Thrust/4) # Thrust per motor
-        c.throttleCRSF = RPMtoThrottleCRSF(c.rpm)
-        c.throttle = CRSFtoInt(c.throttleCRSF)
+        if c.throttleTable is not None:
+            c.throttleCRSF, c.throttle = c.throttleTable.throttle(c.Thrust/4) # Thrust per motor
+        else:
+            c.rpm = ThrustToRPM(c.Thrust/4) # Thrust per motor
+            c.throttleCRSF = RPMtoThrottleCRSF(c.rpm)
+            c.throttle = CRSFtoInt(c.throttleCRSF)
         # applyRotation()
 
         c.yaw = degPerSecToInt(c.w_y)
@@ -111,39 +113,62 @@ def control():
     log(f"Thrust: {c.Thrust}, RPM: {c.rpm}")
     passValues(c.yaw, c.pitch, c.roll, c.throttle, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0)
 
-@safeCall
+def controlArray(forward, sideways, vertical, angle, verticalOffset=None):
+    """Array version of control() for batches of simulated drones, one
+    element per drone, each with its own vertical acceleration offset.
+    Returns the (yaw, pitch, roll, throttle) channels instead of passing
+    them, always through the conversion functions (never the throttle
+    lookup table), and raises a ValueError for values out of range."""
+    if verticalOffset is None:
+        verticalOffset = VERTICAL_ACCELERATION_OFFSET_SIM if c.virtual else VERTICAL_ACCELERATION_OFFSET
+    forward, sideways, vertical, angle = (np.asarray(v, dtype=np.float64) for v in (forward, sideways, vertical, angle))
+    zeroThrottle = vertical == -10
+    vertical = np.where(zeroThrottle, 0, vertical)
+    for name, value in (("forward", forward), ("sideways", sideways), ("vertical", vertical), ("angle", angle)):
+        if ((value > 1) | (value < -1)).any():
+            raise ValueError(f"Invalid {name} values. Must be between -1 and 1.")
+
+    a_x = forward*MAX_FORWARD_ACCELERATION
+    a_y = sideways*MAX_SIDEWAYS_ACCELERATION
+    a_z = (vertical+verticalOffset)*MAX_VERTICAL_ACCELERATION
+    w_y = angle*MAX_ANGULAR_ACCELERATION
+
+    Theta = np.arctan(a_x/(a_z+G)) * DEG_TO_RAD
+    Phi = np.arctan(a_y/(a_z+G)) * DEG_TO_RAD
+    Thrust = MASS * np.sqrt(a_x**2 + a_y**2 + (a_z+G)**2)
+    throttle = CRSFtoIntArray(RPMtoThrottleCRSFArray(ThrustToRPMArray(Thrust/4))) # Thrust per motor
+
+    off = lambda value: np.where(zeroThrottle, 0, value)
+    return (off(degPerSecToIntArray(w_y)), off(degPerSecToIntArray(Theta)), off(degPerSecToIntArray(Phi)),
+            np.where(zeroThrottle, -32760, throttle))
+
 def Hover():
     c.forward = 0
     c.sideways = 0
     c.vertical = 0
     c.angle = 0
 
-@safeCall
 def flyForward():
     c.forward = 0.5
     c.sideways = 0
     c.vertical = 0
     c.angle = 0
 
-@safeCall
 def followHoops():
-    contour, center = findContour(c.image, RED, GREEN, BLUE)
-    if center is None:
+    blob = findContour(c.image, RED, GREEN, BLUE)
+    if blob is None or blob.center is None:
         return
     else:
+        center = blob.center
         dx = remap_range(center[1], 0, 640, -32768, 32767) # Center is (y, x)
         dy = remap_range(center[0], 0, 480, 32767, -32768) # dy is positive when the hoop is above the center
         print("dx: ", dx, "dy: ", dy)
 
-    # Display the image
-    cv.imshow("frame", c.image)
     print("Center: ", center)
 
-@safeCall
 def _getAngle(x):
     return remap_range(x, 0, 640, -60, 60)/MAX_ANGULAR_ACCELERATION
 
-@safeCall
 def followTarget(*colors):
     """Follow the biggest object of the specified color(s)."""
     c.forward = 0.25
@@ -151,10 +176,11 @@ def followTarget(*colors):
     c.vertical = 0
     c.angle = 0
 
-    _, center = findContour(c.image, *colors)
-    if center is None:
+    blob = findTarget(*colors)
+    if blob is None or blob.center is None:
         return
     else:
+        center = blob.center
         c.sd.accelW = _getAngle(center[1])
         if c.timer == 0:
             c.sd.accelZ = _getAccel(center[0], CAM_HEIGHTD2, STABILIZED_HOVER_STEP_ACCELERATION_ZD2)
@@ -174,7 +200,6 @@ def followTarget(*colors):
         log(f"\tAngle: {c.angle}")
         log(f"\tVertical: {c.vertical}\n\n")
 
-@safeCall
 def _getAccel(center, mid, accel):
     """Get the acceleration needed to align the drone with the point
     of reference It is used in the Stabilize() function that does not
@@ -186,7 +211,6 @@ def _getAccel(center, mid, accel):
     else:
         return accel
 
-@safeCall
 def Stabilize(preview=False):
     """Align the drone with the point of reference and stabilize it.
     The movement is *not* smooth."""
@@ -195,10 +219,11 @@ def Stabilize(preview=False):
     c.vertical = 0
     c.angle = 0
 
-    _, center = findContour(c.image, BLUE)
-    if center is None:
+    blob = findTarget(BLUE)
+    if blob is None or blob.center is None:
         return
     else:
+        center = blob.center
         if c.timer == 0:
             c.sd.accelZ = _getAccel(center[0], CAM_HEIGHTD2, STABILIZED_HOVER_STEP_ACCELERATION_ZD2)
             c.sd.accelX = _getAccel(center[1], CAM_WIDTHD2, STABILIZED_HOVER_STEP_ACCELERATION_YD2)
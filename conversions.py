@@ -1,63 +1,144 @@
 import math
+import numpy as np
 from config import PI, RHO
-from basic import safeCall, cleanup
 
 #################################################################
 ###############  CONVERSION FUNCTIONS - START  ##################
 #################################################################
-const = (PI * RHO * (0.0762**2) * 0.0635) / (3600 * 4 * 50) # * (RPM**2)
-@safeCall
+# Motor model, every conversion and the throttle lookup table use these
+PROP_DIAMETER = 0.0762 # m
+PROP_PITCH = 0.0635 # m
+RPM_TO_CRSF_SLOPE = 0.02080581 # CRSF per RPM, measured
+RPM_TO_CRSF_OFFSET = 971.4899 # CRSF at 0 RPM, measured
+CRSF_MIN = 1000
+CRSF_MAX = 2000
+
+const = (PI * RHO * (PROP_DIAMETER**2) * PROP_PITCH) / (3600 * 4 * 50) # * (RPM**2)
 def Thrust(rpm: int):
     """Calculates the thrust produced by a motor spinning at a given RPM."""
     # Simplified thrust formula: T = (pi * rho * D^2 * n^2 * P) / 4
     global const
     return const * (rpm ** 2)
 
-const2 = math.sqrt((4 * 50 * 3600) / (PI * RHO * (0.0762 ** 2) * 0.0635)) # * sqrt(RPM)
-@safeCall
+const2 = math.sqrt((4 * 50 * 3600) / (PI * RHO * (PROP_DIAMETER ** 2) * PROP_PITCH)) # * sqrt(RPM)
 def ThrustToRPM(thrust: float):
     """Calculates the RPM of a motor needed to produce the given thrust by it."""
     global const2
     return int((math.sqrt(thrust)) * const2)
 
-@safeCall
 def RPMtoThrottleCRSF(rpm: int):
     """Converts the RPM of a motor to a CRSF throttle value [1000, 2000]."""
     
-    return int(0.02080581*rpm + 971.4899)
+    return int(RPM_TO_CRSF_SLOPE*rpm + RPM_TO_CRSF_OFFSET)
+
+def ThrottleCRSFtoRPM(value: int):
+    """Converts a CRSF throttle value [1000, 2000] to the RPM of a motor,
+    the inverse of RPMtoThrottleCRSF()."""
+
+    return int((value - RPM_TO_CRSF_OFFSET) / RPM_TO_CRSF_SLOPE)
 
-const7 = 65535 / 1000
+const7 = 65535 / (CRSF_MAX - CRSF_MIN)
 const8 = 32768
-@safeCall
 def CRSFtoInt(value: int):
     """Converts from CRSF [1000, 2000] to int16 [-32768, 32767]."""
     
-    return int(((value - 1000) * const7) - const8)
+    return int(((value - CRSF_MIN) * const7) - const8)
 
-const3 = 1000 / 65535
-const4 = 1000 + (32768 * const3)
-@safeCall             
+const3 = (CRSF_MAX - CRSF_MIN) / 65535
+const4 = CRSF_MIN + (32768 * const3)
 def intToCRSF(value: int):
     """Converts from int16 [-32768, 32767] to CRSF [1000, 2000]."""
     
     return int((value * const3) + const4)
 
 const5 = 360/(32767+32768)
-@safeCall
 def intToDegPerSec(value: int):
     """Converts Pitch, Roll, and Yaw values [-32768, 32767] to degrees per second."""
     if value > 32767 or value < -32768:
-        print(f"\tInvalid value {value}. Must be between -32768 and 32767.")
-        cleanup()
-        return
+        raise ValueError(f"Invalid value {value}. Must be between -32768 and 32767.")
     return const5*value
 
 const6 = (32767+32768)/360
-@safeCall
 def degPerSecToInt(value: float):
     """Converts degrees per second to int16 [-32768, 32767]."""
     if value > 180 or value < -180:
-        print(f"\tInvalid value {value}. Must be between -180 and 180.")
-        cleanup()
-        return
+        raise ValueError(f"Invalid value {value}. Must be between -180 and 180.")
     return int(const6 * value)
+#################################################################
+################  CONVERSION FUNCTIONS - END  ###################
+#################################################################
+
+
+
+
+
+#################################################################
+##########  VECTORIZED CONVERSION FUNCTIONS - START  ############
+#################################################################
+# Same as the functions above, but they also take NumPy arrays and convert
+# them without Python loops, for log processing and calibration sweeps.
+# Python scalars are passed to the scalar functions, skipping NumPy. Out
+# of range values raise a ValueError like the scalar functions.
+def _checkRange(values, low, high):
+    invalid = (values > high) | (values < low)
+    if invalid.any():
+        raise ValueError(f"{np.count_nonzero(invalid)} invalid values (e.g. {values[invalid].flat[0]}). Must be between {low} and {high}.")
+
+def _isScalar(value):
+    return isinstance(value, (int, float))
+
+def ThrustArray(rpm):
+    """Array version of Thrust()."""
+    if _isScalar(rpm):
+        return Thrust(rpm)
+    rpm = np.asarray(rpm, dtype=np.float64)
+    return const * np.square(rpm)
+
+def ThrustToRPMArray(thrust):
+    """Array version of ThrustToRPM()."""
+    if _isScalar(thrust):
+        return ThrustToRPM(thrust)
+    return (np.sqrt(np.asarray(thrust, dtype=np.float64)) * const2).astype(np.int64)
+
+def RPMtoThrottleCRSFArray(rpm):
+    """Array version of RPMtoThrottleCRSF()."""
+    if _isScalar(rpm):
+        return RPMtoThrottleCRSF(rpm)
+    return (RPM_TO_CRSF_SLOPE * np.asarray(rpm, dtype=np.float64) + RPM_TO_CRSF_OFFSET).astype(np.int64)
+
+def ThrottleCRSFtoRPMArray(value):
+    """Array version of ThrottleCRSFtoRPM()."""
+    if _isScalar(value):
+        return ThrottleCRSFtoRPM(value)
+    return ((np.asarray(value, dtype=np.float64) - RPM_TO_CRSF_OFFSET) / RPM_TO_CRSF_SLOPE).astype(np.int64)
+
+def CRSFtoIntArray(value):
+    """Array version of CRSFtoInt()."""
+    if _isScalar(value):
+        return CRSFtoInt(value)
+    return ((np.asarray(value, dtype=np.float64) - CRSF_MIN) * const7 - const8).astype(np.int64)
+
+def intToCRSFArray(value):
+    """Array version of intToCRSF()."""
+    if _isScalar(value):
+        return intToCRSF(value)
+    return (np.asarray(value, dtype=np.float64) * const3 + const4).astype(np.int64)
+
+def intToDegPerSecArray(value):
+    """Array version of intToDegPerSec()."""
+    if _isScalar(value):
+        return intToDegPerSec(value)
+    value = np.asarray(value, dtype=np.float64)
+    _checkRange(value, -32768, 32767)
+    return const5 * value
+
+def degPerSecToIntArray(value):
+    """Array version of degPerSecToInt()."""
+    if _isScalar(value):
+        return degPerSecToInt(value)
+    value = np.asarray(value, dtype=np.float64)
+    _checkRange(value, -180, 180)
+    return (const6 * value).astype(np.int64)
+#################################################################
+###########  VECTORIZED CONVERSION FUNCTIONS - END  #############
+#################################################################
@@ -1,20 +1,22 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-from conversions import Thrust, ThrustToRPM, RPMtoThrottleCRSF, CRSFtoInt, intToCRSF, intToDegPerSec, degPerSecToInt
+from conversions import ThrustArray, ThrustToRPMArray, RPMtoThrottleCRSFArray, CRSFtoIntArray, intToCRSFArray, intToDegPerSecArray, degPerSecToIntArray
 
 def main():
-    RPMvalues = range(1000, 11000, 1000)
-    thrustValues = [Thrust(rpm) for rpm in RPMvalues]
-    RPMcalc = [ThrustToRPM(thrust) for thrust in thrustValues]
+    RPMvalues = np.arange(1000, 11000, 1000)
+    thrustValues = ThrustArray(RPMvalues)
+    RPMcalc = ThrustToRPMArray(thrustValues)
 
-    throttleValues = [RPMtoThrottleCRSF(rpm) for rpm in RPMvalues]
+    throttleValues = RPMtoThrottleCRSFArray(RPMvalues)
 
-    CRSFvalues = range(1000, 2000, 100)
-    intValues = [CRSFtoInt(crsf) for crsf in CRSFvalues]
-    CRSFcalc = [intToCRSF(value) for value in intValues]
+    CRSFvalues = np.arange(1000, 2000, 100)
+    intValues = CRSFtoIntArray(CRSFvalues)
+    CRSFcalc = intToCRSFArray(intValues)
 
-    DegPerSecValues = [intToDegPerSec(value) for value in intValues]
-    intCalc = [degPerSecToInt(deg_sec) for deg_sec in DegPerSecValues]
+    DegPerSecValues = intToDegPerSecArray(intValues)
+    # -32768 maps to slightly less than -180 deg/s, which degPerSecToInt() rejects
+    intCalc = degPerSecToIntArray(np.clip(DegPerSecValues, -180, 180))
 
     thrust = pd.DataFrame({"RPM": RPMvalues, "Thrust": thrustValues, "RPM Back": RPMcalc})
     throttle = pd.DataFrame({"RPM": RPMvalues, "Throttle CRSF": throttleValues})
@@ -0,0 +1,199 @@
+import os
+import sys
+import csv
+import json
+import struct
+import numpy as np
+from datetime import datetime
+from config import State, FlyingState
+
+"""
+Binary blackbox format.
+
+A 512 byte header followed by fixed size records of RECORD_DTYPE, so a log
+can be appended to from the control loop and read back with np.memmap
+without any parsing. The header holds the record dtype, so readers do not
+depend on this file's RECORD_DTYPE, and the offset that turns the monotonic
+record times into wall clock (epoch) times.
+"""
+
+MAGIC = b"DCBB"
+VERSION = 1
+HEADER = struct.Struct("<4sHHId") # magic, version, header size, record size, wall clock offset
+HEADER_SIZE = 512
+
+RECORD_DTYPE = np.dtype([
+    ("time", "<f8"), # time.monotonic()
+    ("state", "u1"),
+    ("flyingState", "u1"),
+    ("yaw", "<i2"),
+    ("pitch", "<i2"),
+    ("roll", "<i2"),
+    ("throttle", "<i2"),
+    ("pitchAngle", "<f4"),
+    ("rollAngle", "<f4"),
+    ("angle", "<f4"),
+    ("a_x", "<f4"),
+    ("a_y", "<f4"),
+    ("a_z", "<f4"),
+    ("w_y", "<f4"),
+    ("thrust", "<f4"),
+    ("dt", "<f8"), # The c.dt the tick ran with, used by replay.py
+])
+
+# CSV column -> record field, in the order of the CSV log
+CSV_COLUMNS = {
+    "Timestamp": "time",
+    "State": "state",
+    "Flying State": "flyingState",
+    "Yaw int16": "yaw",
+    "Pitch int16": "pitch",
+    "Pitch Angle": "pitchAngle",
+    "Roll int16": "roll",
+    "Roll Angle": "rollAngle",
+    "Throttle int16": "throttle",
+    "Acc X": "a_x",
+    "Acc Y": "a_y",
+    "Acc Z": "a_z",
+    "W Y": "w_y",
+    "Thrust": "thrust",
+    "Dt": "dt",
+}
+
+
+class FlightLogWriter:
+    """Appends records to a binary flight log."""
+
+    def __init__(self, path, wallOffset):
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            descr = json.dumps(RECORD_DTYPE.descr, separators=(",", ":")).encode()
+            header = HEADER.pack(MAGIC, VERSION, HEADER_SIZE, RECORD_DTYPE.itemsize, wallOffset) + descr
+            if len(header) > HEADER_SIZE:
+                raise ValueError("The record dtype does not fit in the header")
+            self.file.write(header.ljust(HEADER_SIZE, b"\0"))
+
+    def append(self, records):
+        self.file.write(records.astype(RECORD_DTYPE, copy=False).tobytes())
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CsvLogWriter:
+    """Appends records to a CSV log, the format used before the binary one."""
+
+    def __init__(self, path, wallOffset):
+        self.wallOffset = wallOffset
+        self.file = open(path, "a", newline='')
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(CSV_COLUMNS)
+
+    def append(self, records):
+        self.writer.writerows(self.row(record) for record in records)
+
+    def row(self, record):
+        return [
+            datetime.fromtimestamp(record["time"] + self.wallOffset).isoformat(),
+            State(record["state"]).name,
+            FlyingState(record["flyingState"]).name,
+            record["yaw"],
+            record["pitch"],
+            round(float(record["pitchAngle"]), 4),
+            record["roll"],
+            round(float(record["rollAngle"]), 4),
+            record["throttle"],
+            record["a_x"],
+            record["a_y"],
+            record["a_z"],
+            record["w_y"],
+            record["thrust"],
+            record["dt"] if "dt" in record.dtype.names else "", # Older logs do not have it
+        ]
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def openFlightLog(path):
+    """Maps a binary flight log. Returns (records, wallOffset), where
+    records is a read-only np.memmap of the complete records in the file."""
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    magic, version, headerSize, recordSize, wallOffset = HEADER.unpack_from(header)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a DroneCtrl flight log")
+    if version != VERSION:
+        raise ValueError(f"Unsupported flight log version {version}")
+
+    descr = header[HEADER.size:headerSize].rstrip(b"\0")
+    dtype = np.dtype([tuple(field) for field in json.loads(descr)])
+    if dtype.itemsize != recordSize:
+        raise ValueError(f"Corrupted flight log header in {path}")
+
+    # A record that was being written when the program stopped is ignored
+    count = (os.path.getsize(path) - headerSize) // recordSize
+    if count == 0:
+        return np.zeros(0, dtype=dtype), wallOffset
+    return np.memmap(path, dtype=dtype, mode="r", offset=headerSize, shape=(count,)), wallOffset
+
+
+def readCsvLog(csvPath):
+    """Reads a CSV log into records like the ones of a binary flight log.
+    Returns (records, wallOffset). Columns the CSV log does not have are
+    left at zero."""
+    with open(csvPath, newline='') as f:
+        rows = list(csv.DictReader(f))
+    records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+    if rows:
+        times = np.array([datetime.fromisoformat(row["Timestamp"]).timestamp() for row in rows])
+        wallOffset = times[0]
+        records["time"] = times - wallOffset
+        records["state"] = [State[row["State"]] for row in rows]
+        records["flyingState"] = [FlyingState[row["Flying State"]] for row in rows]
+        for column, field in CSV_COLUMNS.items():
+            if column not in ("Timestamp", "State", "Flying State") and rows[0].get(column, "") != "":
+                records[field] = np.array([row[column] for row in rows], dtype=np.float64)
+    else:
+        wallOffset = 0.0
+    return records, wallOffset
+
+
+def loadFlightLog(path):
+    """Returns (records, wallOffset) of a CSV or binary (.bbx) flight log."""
+    return openFlightLog(path) if path.endswith(".bbx") else readCsvLog(path)
+
+
+def csvToFlightLog(csvPath, logPath):
+    """Converts a CSV log to a binary flight log."""
+    records, wallOffset = readCsvLog(csvPath)
+    writer = FlightLogWriter(logPath, wallOffset)
+    writer.append(records)
+    writer.close()
+
+
+def flightLogToCsv(logPath, csvPath):
+    """Converts a binary flight log to a CSV log."""
+    records, wallOffset = openFlightLog(logPath)
+    writer = CsvLogWriter(csvPath, wallOffset)
+    writer.append(records)
+    writer.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in ("tocsv", "tobin"):
+        print("Usage: python flightlog.py tocsv <log.bbx> <log.csv>")
+        print("       python flightlog.py tobin <log.csv> <log.bbx>")
+        sys.exit(1)
+
+    if sys.argv[1] == "tocsv":
+        flightLogToCsv(sys.argv[2], sys.argv[3])
+    else:
+        csvToFlightLog(sys.argv[2], sys.argv[3])
@@ -1,18 +1,26 @@
 from config import *
 from config import Config as c
-from basic import safeCall, handle_signal, cleanup, Arm
+from basic import handle_signal, cleanup, Arm
 import logging
 import posix_ipc
 import mmap
-import numpy as np
-import struct
 import cv2 as cv
 import argparse
 import sys
 from utils import getFrame
+from capture import CaptureThread
+from channels import ChannelWriter, CHANNELS
+from telemetry import TelemetryLogger
+from profiler import StageProfiler
+from keys import StdinKeys, QueueKeys
+from preview import PreviewThread
+from vision import VisionPool
+from virtcam import VirtualCameraReader, SEGMENT_SIZE as VIRTUAL_CAMERA_SEGMENT_SIZE
+from throttletable import ThrottleTable
+from datetime import datetime
+from segmentation import getSegmenter
 from takeoff import CalculateTakeoff, CalculateLanding
 
-@safeCall
 def initSignalHandlers():
     """Initializes signal handlers for the program."""
     logging.debug("\tInitializing signal handlers...")
@@ -20,38 +28,96 @@ def initSignalHandlers():
         signal.signal(sig, handle_signal)
     logging.debug("\tSignal handlers initialized")
 
-@safeCall
 def initSharedMemory():
     """Initializes shared memory for the program."""
     logging.debug("\tInitializing shared memory...") 
-    c.memory = posix_ipc.SharedMemory("/myshm")
+    c.memory = posix_ipc.SharedMemory(c.shmName)
     c.mapFile = mmap.mmap(c.memory.fd, c.memory.size)
-    c.values = struct.unpack('i'*16, c.mapFile.read(64))
+    c.values = CHANNELS.unpack_from(c.mapFile, 0)
+    c.channels = ChannelWriter(c.mapFile)
+    if not c.channels.seqlock:
+        logging.debug("\tShared memory has no room for the frame header, writing channels only")
     logging.debug("\tShared memory initialized")
 
-@safeCall
 def initCamera():
     """Initializes the camera for the program."""
     if c.virtual:
         logging.debug("\tInitializing virtual camera...")
 
-        c.virtCamMemory = posix_ipc.SharedMemory("/myVirtCamMem", posix_ipc.O_CREAT, size=VIRTUAL_IMAGE_SIZE)
-        c.virtCamMapFile = mmap.mmap(c.virtCamMemory.fd, VIRTUAL_IMAGE_SIZE)
-        c.image = np.zeros((VIRTUAL_IMAGE_SIZE_X, VIRTUAL_IMAGE_SIZE_Y, VIRTUAL_IMAGE_SIZE_Z), dtype=np.uint8)
+        # The frame plus the header of virtcam.py, an existing smaller segment is grown
+        c.virtCamMemory = posix_ipc.SharedMemory(c.virtCamShmName, posix_ipc.O_CREAT, size=VIRTUAL_CAMERA_SEGMENT_SIZE)
+        c.virtCamMapFile = mmap.mmap(c.virtCamMemory.fd, VIRTUAL_CAMERA_SEGMENT_SIZE)
+        c.virtCam = VirtualCameraReader(c.virtCamMapFile)
+        c.image = c.virtCam.front
 
         logging.debug("\tVirtual camera initialized")
     else:
         logging.debug("\tInitializing camera...")
         
         c.cap = cv.VideoCapture("/dev/video2")
+
+        if c.captureThread:
+            # Keep the driver queue short, the thread always wants the newest frame
+            c.cap.set(cv.CAP_PROP_BUFFERSIZE, 1)
+            # Started by startCapture(), once the vision workers are forked
+            c.capThread = CaptureThread(c.cap, (CAM_HEIGHT, CAM_WIDTH, 3))
+            logging.debug("\tCapture thread initialized")
         
         logging.debug("\tCamera initialized")
 
-@safeCall
+    # Build (or load) the color lookup tables before the first frame
+    getSegmenter(SEGMENTATION_COLORS)
+
+def initKeys():
+    """Opens the source of the keyboard commands: stdin or a message queue
+    in headless mode, the preview window otherwise."""
+    logging.debug("\tInitializing keys...")
+    if c.headless:
+        c.keys = QueueKeys(KEY_QUEUE_NAME) if c.keySource == "mqueue" else StdinKeys()
+    else:
+        # No frame has been captured yet, submit() adapts to other frame sizes
+        c.preview = PreviewThread((CAM_HEIGHT, CAM_WIDTH, 3), c.previewFps)
+        c.preview.start()
+        c.keys = c.preview
+    logging.debug("\tKeys initialized")
+
+def initVision():
+    """Starts the vision worker processes."""
+    if c.visionWorkers > 0:
+        logging.debug("\tInitializing vision workers...")
+        # The real camera has no frame yet, and the workers are forked
+        # before startCapture() so no other thread is running
+        shape = c.image.shape if c.image is not None else (CAM_HEIGHT, CAM_WIDTH, 3)
+        c.vision = VisionPool(shape, c.visionWorkers)
+        logging.debug("\tVision workers initialized")
+
+def startCapture():
+    """Starts the capture thread, after initVision() has forked the vision
+    workers: forking while it holds the camera and its locks is unsafe."""
+    if c.capThread is not None:
+        c.capThread.start()
+        logging.debug("\tCapture thread started")
+
+def initTelemetry():
+    """Starts the thread that prints debug info and writes the log."""
+    logging.debug("\tInitializing telemetry...")
+    c.startTime = datetime.now()
+    extension = "bbx" if c.binaryBlackbox else "csv"
+    c.telemetry = TelemetryLogger(f"./logs/log{c.startTime}.{extension}", c.binaryBlackbox)
+    c.telemetry.start()
+    if c.profileStages:
+        c.profiler = StageProfiler()
+    logging.debug("\tTelemetry initialized")
+
+def initThrottleTable():
+    """Builds (or loads) the thrust to throttle lookup table."""
+    if c.throttleLut:
+        c.throttleTable = ThrottleTable(THROTTLE_LUT_SIZE)
+
 def getFirstFrame():
     logging.debug("\tGetting first frame...")
 
-    ret = getFrame()
+    ret = getFrame(FIRST_FRAME_TIMEOUT)
     if ret:
         logging.debug("\tFirst frame captured")
         logging.debug("\tArming drone...")
@@ -67,19 +133,64 @@ def getFirstFrame():
         cleanup()
         return
 
-@safeCall
-def initArgumentParser():
+def initArgumentParser(argv=None):
+    """Parses the command line, or `argv` if given, into Config."""
     parser = argparse.ArgumentParser(
         description="A program that controls a drone and makes it autonomous."
     )
     parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
     parser.add_argument("--virt", help="use virtual camera", action="store_true")
+    parser.add_argument("--sim-clock", help="with --virt, follow the simulation time of the frames instead of the wall clock", action="store_true")
+    parser.add_argument("--capture-thread", help="grab camera frames on a background thread", action="store_true")
+    parser.add_argument("--color-lut", help="classify colors with a precomputed lookup table", action="store_true")
+    parser.add_argument("--roi", help="only search around the last detected target", action="store_true")
+    parser.add_argument("--vision-workers", help="run the detection in this many worker processes", type=int)
+    parser.add_argument("--detection-levels", help="run detection on an image 2^N times smaller", type=int, choices=range(0, 4))
+    parser.add_argument("--refine", help="refine downscaled detections at full resolution", action="store_true")
+    parser.add_argument("--blob-backend", help="how blobs are extracted from the color masks", choices=["contours", "components"])
+    parser.add_argument("--blackbox", help="format of the flight log written to ./logs", choices=["csv", "bin"])
+    parser.add_argument("--throttle-lut", help="look up the throttle in a precomputed table", action="store_true")
+    parser.add_argument("--control-rate", help="run the control loop at this rate in Hz on its own thread", type=float)
+    parser.add_argument("--profile", help="time each stage of the main loop", action="store_true")
+    parser.add_argument("--headless", help="run without windows or terminal redraws", action="store_true")
+    parser.add_argument("--preview-fps", help="redraw the preview window at most this often, 0 for every frame", type=float)
+    parser.add_argument("--keys", help="where the keys come from in headless mode", choices=["stdin", "mqueue"])
     parser.add_argument("--version", help="print the version of DroneCtrl", action="store_true")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
     if args.virt:
         c.virtual = True
+    if args.sim_clock:
+        c.simClock = True
+    if args.capture_thread:
+        c.captureThread = True
+    if args.color_lut:
+        c.colorLut = True
+    if args.roi:
+        c.roiTracking = True
+    if args.vision_workers is not None:
+        c.visionWorkers = args.vision_workers
+    if args.detection_levels is not None:
+        c.detectionLevels = args.detection_levels
+    if args.refine:
+        c.detectionRefine = True
+    if args.blob_backend is not None:
+        c.blobBackend = args.blob_backend
+    if args.blackbox is not None:
+        c.binaryBlackbox = args.blackbox == "bin"
+    if args.throttle_lut:
+        c.throttleLut = True
+    if args.control_rate is not None:
+        c.controlRate = args.control_rate
+    if args.profile:
+        c.profileStages = True
+    if args.headless:
+        c.headless = True
+    if args.preview_fps is not None:
+        c.previewFps = args.preview_fps
+    if args.keys is not None:
+        c.keySource = args.keys
     if args.version:
         print(f"DroneCtrl v{VERSION_NUMBER}")
         sys.exit(0)
@@ -0,0 +1,91 @@
+import os
+import sys
+import tty
+import select
+import termios
+import logging
+import posix_ipc
+
+"""
+Keyboard commands without OpenCV HighGUI, for --headless mode.
+
+poll() never blocks and returns the code of the next key like cv.waitKey()
+does, or -1 if no key was pressed.
+"""
+
+
+class StdinKeys:
+    """Reads keys from stdin. A terminal is switched to cbreak mode, so keys
+    arrive without Enter (Ctrl+C still works), and restored by close(). Keys
+    can also be piped in."""
+
+    def __init__(self):
+        self.fd = sys.stdin.fileno()
+        self.pending = b""
+        self.savedMode = None
+        if os.isatty(self.fd):
+            self.savedMode = termios.tcgetattr(self.fd)
+            tty.setcbreak(self.fd)
+        self.open = True
+
+    def poll(self):
+        if not self.pending and self.open:
+            if select.select([self.fd], [], [], 0)[0]:
+                data = os.read(self.fd, 64)
+                if not data: # End of a piped input
+                    self.open = False
+                self.pending = data.replace(b"\n", b"")
+        if not self.pending:
+            return -1
+        key = self.pending[0]
+        self.pending = self.pending[1:]
+        return key
+
+    def close(self):
+        if self.savedMode is not None:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self.savedMode)
+            self.savedMode = None
+
+
+class QueueKeys:
+    """Reads keys from a POSIX message queue, one or more keys per message,
+    e.g. from another program or a ground station link."""
+
+    def __init__(self, name):
+        self.queue = posix_ipc.MessageQueue(name, posix_ipc.O_CREAT)
+        self.pending = b""
+        logging.debug(f"\tListening for keys on message queue {name}")
+
+    def poll(self):
+        if not self.pending:
+            try:
+                self.pending, _ = self.queue.receive(0)
+            except posix_ipc.BusyError: # Empty
+                return -1
+        key = self.pending[0]
+        self.pending = self.pending[1:]
+        return key
+
+    def close(self):
+        self.queue.close()
+        try:
+            self.queue.unlink()
+        except posix_ipc.ExistentialError:
+            pass
+
+
+def sendKeys(name, keys):
+    """Sends keys to a program polling QueueKeys(name)."""
+    queue = posix_ipc.MessageQueue(name, posix_ipc.O_CREAT)
+    queue.send(keys.encode())
+    queue.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python keys.py <keys>")
+        print("Sends the keys to DroneCtrl running with --headless --keys mqueue")
+        sys.exit(1)
+
+    from config import KEY_QUEUE_NAME
+    sendKeys(KEY_QUEUE_NAME, sys.argv[1])
@@ -1,4 +1,3 @@
-import cv2 as cv
 import logging
 import time
 from typing import *
@@ -11,83 +10,103 @@ from basic import *
 from control import *
 from takeoff import *
 from init import *
+from scheduler import FixedRateScheduler
 
 
 def Awake():
     """Initialization function that is called first even before Start()"""
     print("Program started")
-    initSignalHandlers()
+    supervise(initSignalHandlers)
 
 def Start():
     """Initialization function that is called once when the program starts."""
-    initSharedMemory()
-    initCamera()
+    supervise(initSharedMemory)
+    supervise(initCamera)
+    supervise(initVision)
+    supervise(startCapture)
+    supervise(initTelemetry)
+    supervise(initKeys)
+    supervise(initThrottleTable)
     
     logging.debug("\tDisarming drone...")
 
     Disarm()
 
     logging.debug("\tDrone disarmed")
-    getFirstFrame()
+    supervise(getFirstFrame)
 
 def UpdateHelp():
-    initialTime = time.perf_counter()
+    if c.profiler is not None:
+        c.profiler.reset() # Only time the main loop, not the initialization
+    if c.controlRate > 0:
+        c.debugInfo = "" # The first ticks can log before the first Update()
+        c.scheduler = FixedRateScheduler(c.controlRate, ControlTickHelp)
+        c.scheduler.start()
+
+    initialTime = c.virtCam.simTime if c.simClock and c.virtCam is not None else time.perf_counter()
     while c.running:
         c.debugInfo = ""
-        Update()
-
-        currentTime = time.perf_counter()
+        supervise(Update)
+        if c.profiler is not None:
+            c.profiler.endTick("Update")
+
+        if c.virtCam is not None:
+            c.virtCam.done()
+
+        if c.simClock and c.virtCam is not None:
+            # Frames that did not change took no simulation time
+            currentTime = c.virtCam.simTime
+        else:
+            currentTime = time.perf_counter()
         c.dt = currentTime - initialTime
         initialTime = currentTime
     
     cleanup()
 
 def Update():
+    enterStage("capture")
+    c.overlays.clear()
     ret = getFrame()
     if not ret:
         log("Error: failed to capture image")
         c.running = False
         return
     else:
-        keyPressed = cv.waitKey(1)
+        enterStage("keys")
+        keyPressed = c.keys.poll()
         log(str(c.dt))
 
 
+        enterStage("state")
         if c.state == State.Disarmed:
             if keyPressed == ord('r'):
-                Arm()
-                c.state = State.Grounded
+                with c.lock:
+                    Arm()
+                    c.state = State.Grounded
                 log("Armed")
                 
         elif c.state == State.Grounded:
             if keyPressed == ord('w'):
-                c.state = State.TakingOff
-                c.takeoffCnt = 0
+                # The control scheduler reads these under the lock
+                with c.lock:
+                    c.state = State.TakingOff
+                    c.takeoffCnt = 0
                 log("Taking off...")
             elif keyPressed == ord('r'):
-                Disarm()
+                with c.lock:
+                    Disarm()
                 log("Disarmed")
             else:
                 ZeroThrottle()
 
-        elif c.state == State.TakingOff:
-            if c.takeoffCnt < TAKEOFF_TIME1:
-                Takeoff(1)
-            elif c.takeoffCnt < TAKEOFF_TIME:
-                Takeoff(2)
-            else:
-                c.state = State.Flying
-                c.flyingState = FlyingState.Hovering
-                c.takeoffCnt = 0
-                log("Flying...")
-                Hover()
-
-            c.takeoffCnt += c.dt
+        elif c.state == State.TakingOff and c.scheduler is None:
+            TakeoffLandingTick(c.dt)
 
         elif c.state == State.Flying:
             if keyPressed == ord('s'):
-                c.state = State.Landing
-                c.landingCnt = 0
+                with c.lock:
+                    c.state = State.Landing
+                    c.landingCnt = 0
                 log("Landing...")
             elif keyPressed == ord('f'):
                 c.flyingState = FlyingState.FollowingObject
@@ -124,32 +143,81 @@ def Update():
                 Stabilize(preview=True)
                 c.timer += c.dt
 
-        elif c.state == State.Landing:
-            if c.landingCnt < LANDING_TIME1:
-                Land(1)
-            elif c.landingCnt < LANDING_TIME:
-                Land(2)
-            else:
-                ZeroThrottle()
-                c.state = State.Grounded
-                c.landingCnt = 0
-                log("Landed")
-            
-            c.landingCnt += c.dt
+        elif c.state == State.Landing and c.scheduler is None:
+            TakeoffLandingTick(c.dt)
 
 
-        control()
+        if c.scheduler is None:
+            # Takeoff and landing already advanced in the state machine, so
+            # they start on the tick after the key like they always did
+            enterStage("control")
+            control()
+        elif c.state in (State.Grounded, State.Flying):
+            # Picked up by the next tick of the control scheduler
+            c.setpoints = (c.forward, c.sideways, c.vertical, c.angle)
+            log(f"Control scheduler: {c.scheduler.stats()}")
 
 
         if keyPressed == ord('q'):
             c.running = False
         
-        cv.imshow("frame", c.image)
+        if c.preview is not None:
+            enterStage("preview")
+            c.preview.submit(c.image, c.overlays)
+        enterStage("telemetry")
         printDebugInfo()
 
+def TakeoffLandingTick(dt):
+    """Advances takeoff and landing by `dt` seconds. Called from the state
+    machine of Update(), or by ControlTick() with the control scheduler."""
+    if c.state == State.TakingOff:
+        if c.takeoffCnt < TAKEOFF_TIME1:
+            Takeoff(1)
+        elif c.takeoffCnt < TAKEOFF_TIME:
+            Takeoff(2)
+        else:
+            c.state = State.Flying
+            c.flyingState = FlyingState.Hovering
+            c.takeoffCnt = 0
+            log("Flying...")
+            Hover()
+            c.setpoints = (c.forward, c.sideways, c.vertical, c.angle)
+
+        c.takeoffCnt += dt
+
+    elif c.state == State.Landing:
+        if c.landingCnt < LANDING_TIME1:
+            Land(1)
+        elif c.landingCnt < LANDING_TIME:
+            Land(2)
+        else:
+            ZeroThrottle()
+            c.state = State.Grounded
+            c.landingCnt = 0
+            log("Landed")
+            c.setpoints = (c.forward, c.sideways, c.vertical, c.angle)
+        
+        c.landingCnt += dt
+
+def ControlTick(dt):
+    """A tick of the control scheduler: advances takeoff and landing by `dt`
+    seconds and passes the commands to the drone."""
+    TakeoffLandingTick(dt)
+    if c.state in (State.Grounded, State.Flying):
+        control(c.setpoints)
+    else:
+        control()
+
+def ControlTickHelp(dt):
+    """A tick of the control scheduler."""
+    with c.lock:
+        enterStage("control")
+        supervise(ControlTick, dt)
+        if c.profiler is not None:
+            c.profiler.endTick("ControlTick")
 
 if __name__ == "__main__":
-    initArgumentParser()
+    supervise(initArgumentParser)
     Awake()
     Start()
     UpdateHelp()
@@ -0,0 +1,114 @@
+import time
+import logging
+import threading
+import traceback
+from collections import deque
+import numpy as np
+import cv2 as cv
+from config import Config as c
+from utils import draw_contour, draw_circle
+
+
+def drawOverlays(image, overlays):
+    """Draws the blobs found by the detection on the image, the contour (or
+    the bounding box if there is none) and a dot at the center."""
+    for blob in overlays:
+        if blob.contour is not None:
+            draw_contour(image, blob.contour, blob.color[1])
+        else:
+            x, y, w, h = blob.bbox
+            cv.rectangle(image, (x, y), (x + w, y + h), blob.color[1], 3)
+        if blob.center is not None:
+            draw_circle(image, blob.center)
+
+
+class PreviewThread(threading.Thread):
+    """Shows the camera frames with the detection overlays in a window, on
+    its own thread and at most `fps` times a second (0 for no limit).
+
+    submit() never waits: it copies the frame into a free buffer and
+    returns, or drops the frame if the previous one has not been picked up
+    yet, counting it in `dropped`. All HighGUI calls happen on this thread,
+    so the keys pressed in the window are queued here and read with poll(),
+    like the key sources of keys.py. A frame that fails to draw is skipped
+    and counted in `errors`, so the keys keep working. If the window itself
+    fails, c.running is cleared so the main loop stops."""
+
+    def __init__(self, shape, fps=0):
+        super().__init__(name="PreviewThread", daemon=True)
+        self.period = 1 / fps if fps > 0 else 0
+        self.running = True
+        self.lock = threading.Lock()
+        self.newFrame = threading.Event()
+        self.keys = deque()
+
+        self._slot = np.zeros(shape, dtype=np.uint8) # Written by submit()
+        self._back = np.zeros(shape, dtype=np.uint8) # Drawn on and shown by this thread
+        self._overlays = ()
+        self._pending = False
+        self._nextTime = 0.0
+
+        self.shown = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def submit(self, image, overlays):
+        """Hands a frame and its overlays to the preview. Called from the
+        control loop."""
+        now = time.perf_counter()
+        if now < self._nextTime:
+            return
+        if self._pending:
+            self.dropped += 1
+            return
+        with self.lock:
+            if self._slot.shape != image.shape:
+                self._slot = np.empty_like(image)
+            np.copyto(self._slot, image)
+            self._overlays = tuple(overlays)
+            self._pending = True
+        self._nextTime = now + self.period
+        self.newFrame.set()
+
+    def run(self):
+        try:
+            while self.running:
+                if self.newFrame.wait(0.01):
+                    with self.lock:
+                        self.newFrame.clear()
+                        self._slot, self._back = self._back, self._slot
+                        overlays = self._overlays
+                        self._pending = False
+                    self._show(overlays)
+
+                # Also runs the window's event loop
+                key = cv.waitKey(1)
+                if key != -1:
+                    self.keys.append(key)
+        except Exception as e:
+            # Without this thread no keys arrive, 'q' included
+            print(f"An error occurred in the preview window: {e}")
+            logging.debug(traceback.format_exc())
+            c.running = False
+        cv.destroyAllWindows()
+
+    def _show(self, overlays):
+        try:
+            drawOverlays(self._back, overlays)
+            cv.imshow("frame", self._back)
+            self.shown += 1
+        except Exception as e:
+            self.errors += 1
+            if self.errors == 1:
+                print(f"An error occurred while drawing the preview, skipping the frame: {e}")
+                logging.debug(traceback.format_exc())
+
+    def poll(self):
+        """Returns the next key pressed in the window, or -1."""
+        return self.keys.popleft() if self.keys else -1
+
+    def close(self):
+        self.running = False
+        if self.is_alive():
+            self.join(1)
+        logging.debug(f"\tPreview: {self.shown} frames shown, {self.dropped} dropped, {self.errors} failed")
@@ -0,0 +1,120 @@
+import json
+import threading
+from time import perf_counter_ns
+from tabulate import tabulate
+
+
+class Histogram:
+    """A log-linear latency histogram in nanoseconds.
+
+    Every power of two is split into 8 buckets, so percentiles are accurate
+    to about 6% whatever the scale, and adding a sample is a few integer
+    operations on a list."""
+
+    def __init__(self):
+        self.counts = [0] * 512
+        self.count = 0
+        self.total = 0 # ns
+        self.max = 0 # ns
+
+    def add(self, ns):
+        b = ns.bit_length()
+        self.counts[ns if b < 5 else ((b - 3) << 3) + ((ns >> (b - 4)) & 7)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    @staticmethod
+    def _bucketRange(index):
+        """Returns the [low, high) ns range of a bucket."""
+        if index < 16:
+            return index, index + 1
+        shift = (index >> 3) - 1
+        low = (8 + (index & 7)) << shift
+        return low, low + (1 << shift)
+
+    def percentile(self, p):
+        """Returns the p-th percentile in ns, the middle of its bucket."""
+        if self.count == 0:
+            return 0
+        rank = p / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                low, high = self._bucketRange(index)
+                return min((low + high) / 2, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_us": self.total / self.count / 1000 if self.count else 0,
+            "p50_us": self.percentile(50) / 1000,
+            "p99_us": self.percentile(99) / 1000,
+            "max_us": self.max / 1000,
+        }
+
+
+class StageProfiler:
+    """Times the stages of the Update() pipeline.
+
+    Stages are entered with basic.enterStage(), which does nothing unless a
+    profiler is installed in c.profiler. Each thread has its own timeline:
+    the time until the next enterStage() on the same thread is charged to
+    the current stage, and endTick() adds up each stage's time for the tick
+    (a stage can be entered more than once per tick) into its histogram,
+    along with the total of the tick itself. So the stages are exclusive
+    and add up to the tick."""
+
+    def __init__(self):
+        self.histograms = {}
+        self._local = threading.local()
+
+    def _timeline(self):
+        local = self._local
+        if not hasattr(local, "stage"):
+            local.stage = None
+            local.start = local.tickStart = perf_counter_ns()
+            local.times = {}
+        return local
+
+    def enter(self, stage):
+        now = perf_counter_ns()
+        local = self._timeline()
+        if local.stage is not None:
+            local.times[local.stage] = local.times.get(local.stage, 0) + now - local.start
+        local.stage = stage
+        local.start = now
+
+    def endTick(self, name):
+        """Ends the tick of this thread and records it under `name`."""
+        self.enter(None)
+        local = self._local
+        local.times[name] = local.start - local.tickStart
+        for stage, ns in local.times.items():
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.add(ns)
+        local.times = {}
+        local.tickStart = local.start
+
+    def reset(self):
+        """Forgets everything timed so far."""
+        self.histograms = {}
+        self._local = threading.local()
+
+    def summary(self):
+        """Returns {stage: {count, mean_us, p50_us, p99_us, max_us}}."""
+        return {stage: histogram.summary() for stage, histogram in list(self.histograms.items())}
+
+    def table(self):
+        rows = [[stage, s["count"], f"{s['mean_us']:.1f}", f"{s['p50_us']:.1f}", f"{s['p99_us']:.1f}", f"{s['max_us']:.1f}"]
+                for stage, s in self.summary().items()]
+        return tabulate(rows, headers=["Stage", "Count", "Mean us", "p50 us", "p99 us", "Max us"], tablefmt="simple")
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=4)
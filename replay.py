@@ -0,0 +1,253 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import numpy as np
+import cv2 as cv
+from config import *
+from config import Config as c
+from basic import supervise
+from channels import ChannelWriter, SHM_SIZE
+from flightlog import loadFlightLog
+from profiler import StageProfiler
+from telemetry import TelemetryLogger, _int16
+from takeoff import CalculateTakeoff, CalculateLanding
+from segmentation import getSegmenter
+from init import initArgumentParser, initThrottleTable, initVision
+from main import Update
+
+"""
+Offline replay of a recorded flight through Update().
+
+    python3 replay.py <video | frame directory | image pattern> [--log <log>] [main.py options]
+
+Frames come from a video, a directory of images (in name order) or an
+image sequence pattern such as frames/%05d.png. With the flight log of the
+same flight, each tick gets the recorded time step, the keys that caused
+the recorded state changes are pressed again, and the recomputed commands
+are compared with the recorded ones. Nothing runs in real time, the frames
+are processed as fast as possible, and every frame passValues() sends is
+captured in memory instead of going to /myshm.
+"""
+
+
+class FrameSource:
+    """Reads frames from a video, an image sequence pattern or a directory
+    of images, with the cv.VideoCapture read() interface. The first frame
+    can be looked at before the replay starts."""
+
+    def __init__(self, path):
+        self.files = None
+        if os.path.isdir(path):
+            self.files = iter(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                     if os.path.splitext(name)[1].lower() in (".png", ".jpg", ".jpeg", ".bmp")))
+        else:
+            self.cap = cv.VideoCapture(path)
+        self.first = self._read()
+
+    def _read(self):
+        if self.files is None:
+            return self.cap.read()
+        path = next(self.files, None)
+        if path is None:
+            return False, None
+        frame = cv.imread(path)
+        return frame is not None, frame
+
+    def read(self):
+        if self.first is not None:
+            first, self.first = self.first, None
+            return first
+        return self._read()
+
+    def release(self):
+        if self.files is None:
+            self.cap.release()
+
+
+class ReplayKeys:
+    """Presses keys at given ticks, e.g. the ones recovered from a flight log."""
+
+    def __init__(self, events):
+        self.events = events # tick -> key code
+        self.tick = 0
+
+    def poll(self):
+        key = self.events.get(self.tick, -1)
+        self.tick += 1
+        return key
+
+    def close(self):
+        pass
+
+
+class CapturingChannelWriter(ChannelWriter):
+    """Stands in for /myshm: keeps every frame passed to passValues()."""
+
+    def __init__(self):
+        super().__init__(bytearray(SHM_SIZE))
+        self.frames = []
+        self.tick = 0
+
+    def write(self, values):
+        self.frames.append((self.tick,) + tuple(values))
+        return super().write(values)
+
+
+def keysFromLog(records):
+    """Recovers the keys pressed during a recorded flight from its state
+    changes, as {tick: key code}."""
+    flyingKeys = {
+        FlyingState.FollowingObject: "f",
+        FlyingState.Hovering: "h",
+        FlyingState.FlyingForward: "w",
+        FlyingState.StabilizedHover: "a",
+        FlyingState.StabilizedHoverPreview: "p",
+    }
+    events = {}
+    for tick in range(1, len(records)):
+        before, after = State(records["state"][tick - 1]), State(records["state"][tick])
+        key = None
+        if before == State.Disarmed and after == State.Grounded:
+            key = "r"
+        elif before == State.Grounded and after == State.TakingOff:
+            key = "w"
+        elif before == State.Grounded and after == State.Disarmed:
+            key = "r"
+        elif before == State.Flying and after == State.Landing:
+            key = "s"
+        elif before == after == State.Flying and records["flyingState"][tick] != records["flyingState"][tick - 1]:
+            key = flyingKeys.get(FlyingState(records["flyingState"][tick]))
+        if key is not None:
+            events[tick] = ord(key)
+    return events
+
+
+def recordedSteps(records):
+    """The c.dt of every recorded tick. Older logs do not have it, then it
+    is estimated from the record times: c.dt is the time since the
+    previous tick started, which is about the time between the two
+    previous records."""
+    if "dt" in records.dtype.names and records["dt"][1:].any():
+        return np.asarray(records["dt"], dtype=np.float64)
+    steps = np.zeros(len(records))
+    steps[2:] = np.diff(records["time"])[:-1]
+    if len(records) > 1:
+        steps[1] = records["time"][1] - records["time"][0]
+    return steps
+
+
+def parseKeys(text):
+    """Parses "tick:key,tick:key" into {tick: key code}."""
+    events = {}
+    for event in filter(None, text.split(",")):
+        tick, key = event.split(":")
+        events[int(tick)] = ord(key)
+    return events
+
+
+def replay(records=None, keys=None, fps=30, maxFrames=0):
+    """Runs Update() on every frame of c.cap. Returns the replay
+    statistics, with the recomputed commands compared to `records`."""
+    if records is not None and len(records):
+        steps = recordedSteps(records)
+        c.state = State(records["state"][0])
+        c.flyingState = FlyingState(records["flyingState"][0])
+    else:
+        steps = None
+        c.state = State.Grounded
+    c.keys = ReplayKeys(keysFromLog(records) if keys is None and records is not None else keys or {})
+    CalculateTakeoff(TAKEOFF_HEIGHT, TAKEOFF_TIME)
+    CalculateLanding()
+
+    commands = []
+    tick = 0
+    start = time.perf_counter()
+    while c.running and (not maxFrames or tick < maxFrames):
+        c.debugInfo = ""
+        if steps is not None and tick < len(steps):
+            c.dt = steps[tick]
+        else:
+            c.dt = 1 / fps if tick else 0 # Like UpdateHelp(), the first tick runs with dt = 0
+        c.channels.tick = tick
+        supervise(Update)
+        if not c.running:
+            break # Out of frames
+        commands.append((_int16(c.yaw), _int16(c.pitch), _int16(c.roll), _int16(c.throttle)))
+        if c.profiler is not None:
+            c.profiler.endTick("Update")
+        tick += 1
+    elapsed = time.perf_counter() - start
+
+    stats = {"frames": tick, "seconds": elapsed, "fps": tick / elapsed if elapsed else 0.0,
+             "passValues": len(c.channels.frames)}
+    if records is not None and tick:
+        compared = min(tick, len(records))
+        replayed = np.array(commands[:compared], dtype=np.int64)
+        recorded = np.stack([records[name][:compared] for name in ("yaw", "pitch", "roll", "throttle")], axis=1).astype(np.int64)
+        difference = np.abs(replayed - recorded)
+        stats["compared"] = compared
+        stats["mismatchedTicks"] = int(np.count_nonzero(difference.any(axis=1)))
+        stats["maxDifference"] = dict(zip(("yaw", "pitch", "roll", "throttle"), difference.max(axis=0).tolist()))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a recorded flight through the DroneCtrl main loop.",
+                                     epilog="Any other option is passed on to main.py, e.g. --roi or --detection-levels 1.")
+    parser.add_argument("frames", help="video file, directory of images or image sequence pattern")
+    parser.add_argument("--log", help="CSV or binary (.bbx) flight log of the same flight, for timing, keys and comparison")
+    parser.add_argument("--replay-keys", help='keys to press instead of the ones in the log, as "tick:key,..."')
+    parser.add_argument("--fps", help="frame rate assumed without a log (default: 30)", type=float, default=30)
+    parser.add_argument("--max-frames", help="stop after this many frames", type=int, default=0)
+    parser.add_argument("--commands", help="write every captured passValues() frame to this CSV file")
+    parser.add_argument("--record", help="write a new flight log of the replay (.csv or .bbx)")
+    args, rest = parser.parse_known_args()
+    initArgumentParser(rest)
+
+    c.headless = True
+    c.virtual = False
+    c.controlRate = 0
+    c.channels = CapturingChannelWriter()
+    c.cap = FrameSource(args.frames)
+    if c.cap.first[0]:
+        c.image = c.cap.first[1]
+    else:
+        print(f"Could not read any frame from {args.frames}")
+        sys.exit(1)
+
+    getSegmenter(SEGMENTATION_COLORS)
+    supervise(initThrottleTable)
+    supervise(initVision)
+    if c.profileStages:
+        c.profiler = StageProfiler()
+    if args.record:
+        c.telemetry = TelemetryLogger(args.record, args.record.endswith(".bbx"))
+        c.telemetry.start()
+
+    records = loadFlightLog(args.log)[0] if args.log else None
+    keys = parseKeys(args.replay_keys) if args.replay_keys is not None else None
+    stats = replay(records, keys, args.fps, args.max_frames)
+
+    if c.telemetry is not None:
+        c.telemetry.stop()
+    if c.vision is not None:
+        c.vision.stop()
+    c.cap.release()
+
+    print(f"Replayed {stats['frames']} frames in {stats['seconds']:.2f} s ({stats['fps']:.1f} frames/s), "
+          f"{stats['passValues']} passValues() frames captured")
+    if "compared" in stats:
+        print(f"{stats['mismatchedTicks']} of {stats['compared']} ticks differ from the log, "
+              f"max differences: {stats['maxDifference']}")
+    if c.profiler is not None:
+        print(c.profiler.table())
+    if args.commands:
+        with open(args.commands, "w", newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Tick"] + [f"Channel {i}" for i in range(16)])
+            writer.writerows(c.channels.frames)
+
+if __name__ == "__main__":
+    main()
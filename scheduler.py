@@ -0,0 +1,71 @@
+import time
+import logging
+import threading
+
+
+class FixedRateScheduler(threading.Thread):
+    """Calls tick(dt) at a fixed rate on its own thread.
+
+    Deadlines are kept on an absolute perf_counter() clock, so the rate does
+    not drift with the time tick() takes. `dt` is the measured time since
+    the previous tick. If a tick leaves the next deadline more than one
+    period in the past, that is counted as an overrun and the missed ticks
+    are skipped instead of being run back to back. Jitter is how late each
+    tick started compared to its deadline."""
+
+    def __init__(self, rate, tick):
+        super().__init__(name="FixedRateScheduler", daemon=True)
+        self.period = 1 / rate
+        self.tick = tick
+        self.running = True
+
+        self.ticks = 0
+        self.overruns = 0
+        self.maxLateness = 0.0 # s
+        self.totalLateness = 0.0 # s
+        self.maxTickTime = 0.0 # s
+
+    def run(self):
+        logging.debug(f"\tControl scheduler started at {1 / self.period:.0f} Hz")
+        deadline = time.perf_counter()
+        last = deadline - self.period
+        while self.running:
+            remaining = deadline - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+
+            now = time.perf_counter()
+            lateness = now - deadline
+            self.ticks += 1
+            self.totalLateness += lateness
+            if lateness > self.maxLateness:
+                self.maxLateness = lateness
+
+            self.tick(now - last)
+            last = now
+
+            tickTime = time.perf_counter() - now
+            if tickTime > self.maxTickTime:
+                self.maxTickTime = tickTime
+
+            deadline += self.period
+            if time.perf_counter() - deadline > self.period:
+                self.overruns += 1
+                deadline = time.perf_counter() + self.period
+        logging.debug("\tControl scheduler stopped")
+
+    def stats(self):
+        """Returns the overrun and jitter statistics so far."""
+        return {
+            "rate": 1 / self.period,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "meanJitter": self.totalLateness / self.ticks if self.ticks else 0.0,
+            "maxJitter": self.maxLateness,
+            "maxTickTime": self.maxTickTime,
+        }
+
+    def stop(self):
+        self.running = False
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(1)
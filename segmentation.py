@@ -0,0 +1,216 @@
+import os
+import hashlib
+import logging
+import cv2 as cv
+import numpy as np
+from config import *
+from config import Config as c
+
+
+class Segmenter:
+    """Classifies the colors of a frame.
+
+    masks() converts the frame to HSV once and runs cv.inRange() for each
+    requested color only, so looking for BLUE alone costs one conversion
+    and one inRange(). Hue ranges that wrap around (like RED) take two.
+    labels() classifies every configured color at once into a label image
+    where bit i is set for the pixels of colors[i]: each HSV channel is
+    mapped through a lookup table to the bitmask of the colors whose range
+    contains that value, and the three channels are AND-ed.
+
+    With `useLut` the whole classification is precomputed instead: a 3D
+    table indexed by the quantized B, G and R values of a pixel holds its
+    label directly, so no color conversion happens per frame. The table is
+    built once and cached on disk, keyed by the color ranges and the
+    quantization. labels() reads each pixel as one little-endian BGRA
+    uint32, masks off the dropped low bits of every channel and looks the
+    packed value up in a flattened copy of the table with np.take(), which
+    is a single gather instead of three fancy-index arrays. Pixels within
+    2**(8 - lutBits) levels of a range boundary may be classified
+    differently than with the HSV path."""
+
+    def __init__(self, colors=SEGMENTATION_COLORS, useLut=False, lutBits=COLOR_LUT_BITS):
+        assert len(colors) <= 8, f"At most 8 colors can be segmented at once, got {len(colors)}"
+
+        self.colors = tuple(colors)
+        self.bits = {color: 1 << i for i, color in enumerate(self.colors)}
+
+        values = np.arange(256)
+        self.lut = np.zeros((256, 1, 3), dtype=np.uint8)
+        for (lower, upper), bit in self.bits.items():
+            for channel in range(3):
+                if channel == 0 and lower[0] > upper[0]:
+                    inside = (values >= lower[0]) | (values <= upper[0])
+                else:
+                    inside = (values >= lower[channel]) & (values <= upper[channel])
+                self.lut[inside, 0, channel] |= bit
+
+        # inRange() bounds, two pairs for hue ranges that wrap around
+        self.bounds = {}
+        for lower, upper in self.colors:
+            if lower[0] > upper[0]:
+                self.bounds[(lower, upper)] = ((np.array(lower), np.array((179,) + tuple(upper[1:]))),
+                                               (np.array((0,) + tuple(lower[1:])), np.array(upper)))
+            else:
+                self.bounds[(lower, upper)] = ((np.array(lower), np.array(upper)),)
+
+        self.table = None
+        if useLut:
+            assert 1 <= lutBits <= 8, f"lutBits ({lutBits}) must be between 1 and 8"
+            self.lutShift = 8 - lutBits
+            self.table = self._loadTable(lutBits)
+
+            # Flattened table indexed by (B | G << 8 | R << 16) & lutMask >> lutShift
+            byte = (0xFF << self.lutShift) & 0xFF
+            self.lutMask = byte | byte << 8 | byte << 16
+            q = np.arange(1 << lutBits) << self.lutShift
+            index = (q[:, None, None] | q[None, :, None] << 8 | q[None, None, :] << 16) >> self.lutShift
+            self.flatTable = np.zeros((self.lutMask >> self.lutShift) + 1, dtype=np.uint8)
+            self.flatTable[index] = self.table
+
+    def _hsvLabels(self, color_image):
+        hsv = cv.cvtColor(color_image, cv.COLOR_BGR2HSV)
+        h, s, v = cv.split(cv.LUT(hsv, self.lut))
+        return cv.bitwise_and(cv.bitwise_and(h, s), v)
+
+    def _loadTable(self, lutBits):
+        """Loads the BGR -> label table from the cache, building it if
+        there is no table for these colors and quantization yet."""
+        key = hashlib.sha1(repr((self.colors, lutBits)).encode()).hexdigest()[:16]
+        path = os.path.join(COLOR_LUT_CACHE_DIR, f"colorlut-{key}.npy")
+        n = 1 << lutBits
+
+        if os.path.exists(path):
+            table = np.load(path)
+            if table.shape == (n, n, n):
+                logging.debug(f"\tLoaded color lookup table {path}")
+                return table
+
+        logging.debug("\tBuilding color lookup table...")
+        # Classify the center of every quantization bin with the HSV path
+        levels = (np.arange(n) << (8 - lutBits)) + ((1 << (8 - lutBits)) >> 1)
+        b, g, r = np.meshgrid(levels, levels, levels, indexing="ij")
+        grid = np.stack((b, g, r), axis=-1).astype(np.uint8).reshape(-1, 1, 3)
+        table = self._hsvLabels(grid).reshape(n, n, n)
+
+        os.makedirs(COLOR_LUT_CACHE_DIR, exist_ok=True)
+        np.save(path, table)
+        logging.debug(f"\tColor lookup table saved to {path}")
+        return table
+
+    def labels(self, color_image):
+        """Returns the label image of a BGR frame."""
+        if self.table is None:
+            return self._hsvLabels(color_image)
+        packed = cv.cvtColor(color_image, cv.COLOR_BGR2BGRA).view("<u4")[:, :, 0]
+        packed &= self.lutMask
+        packed >>= self.lutShift
+        return np.take(self.flatTable, packed)
+
+    def _inRange(self, hsv, color):
+        bounds = self.bounds[color]
+        mask = cv.inRange(hsv, *bounds[0])
+        if len(bounds) > 1:
+            cv.bitwise_or(mask, cv.inRange(hsv, *bounds[1]), dst=mask)
+        return mask
+
+    def masks(self, color_image, colors=None):
+        """Returns a {color: mask} dict for the given colors (all of them by
+        default). Masks are non-zero where the pixel is of that color."""
+        if colors is None:
+            colors = self.colors
+        if self.table is None:
+            hsv = cv.cvtColor(color_image, cv.COLOR_BGR2HSV)
+            return {color: self._inRange(hsv, color) for color in colors}
+        labels = self.labels(color_image)
+        return {color: np.bitwise_and(labels, self.bits[color]) for color in colors}
+
+
+class Blob:
+    """A detected blob. Everything the control code needs from a contour
+    is computed once, when the blob is created."""
+
+    __slots__ = ("contour", "color", "moments", "area", "center", "bbox")
+
+    def __init__(self, contour, color=None):
+        self.contour = contour
+        self.color = color
+        self.moments = cv.moments(contour)
+        self.area = abs(self.moments["m00"])
+        if self.moments["m00"] != 0:
+            # (row, column), same as get_contour_center()
+            self.center = (round(self.moments["m01"] / self.moments["m00"]),
+                           round(self.moments["m10"] / self.moments["m00"]))
+        else:
+            self.center = None
+        self.bbox = cv.boundingRect(contour) # (x, y, width, height)
+
+    @classmethod
+    def fromStats(cls, stats, centroid, color=None):
+        """Creates a blob from a row of cv.connectedComponentsWithStats()
+        stats and its centroid. Such blobs have no contour."""
+        blob = cls.__new__(cls)
+        blob.contour = None
+        blob.color = color
+        blob.area = float(stats[cv.CC_STAT_AREA])
+        blob.moments = {"m00": blob.area, "m10": blob.area * centroid[0], "m01": blob.area * centroid[1]}
+        blob.center = (round(centroid[1]), round(centroid[0]))
+        blob.bbox = tuple(int(v) for v in stats[:4])
+        return blob
+
+    def rescale(self, scale):
+        """Scales the blob up by `scale` in place, e.g. to go from an image
+        pyramid level back to full resolution. Only the zeroth and first
+        order raw moments are kept up to date."""
+        if self.contour is not None:
+            self.contour = self.contour * scale
+        self.moments["m00"] *= scale**2
+        self.moments["m10"] *= scale**3
+        self.moments["m01"] *= scale**3
+        self.area = abs(self.moments["m00"])
+        if self.moments["m00"] != 0:
+            self.center = (round(self.moments["m01"] / self.moments["m00"]),
+                           round(self.moments["m10"] / self.moments["m00"]))
+        self.bbox = tuple(v * scale for v in self.bbox)
+        return self
+
+    def translate(self, dx, dy):
+        """Moves the blob by dx columns and dy rows in place. Only the
+        zeroth and first order raw moments are kept up to date."""
+        if self.contour is not None:
+            self.contour = self.contour + np.array((dx, dy), dtype=np.int32)
+        self.moments["m10"] += self.moments["m00"] * dx
+        self.moments["m01"] += self.moments["m00"] * dy
+        if self.center is not None:
+            self.center = (self.center[0] + dy, self.center[1] + dx)
+        x, y, w, h = self.bbox
+        self.bbox = (x + dx, y + dy, w, h)
+        return self
+
+
+def getSegmenter(colors):
+    """Returns the shared segmenter, rebuilding it if one of `colors` is
+    not one of the configured colors."""
+    if c.segmenter is None or any(color not in c.segmenter.bits for color in colors):
+        c.segmenter = Segmenter(tuple(dict.fromkeys(SEGMENTATION_COLORS + tuple(colors))), c.colorLut)
+    return c.segmenter
+
+
+def findMaskContours(mask):
+    """Same as find_contours() but for an already computed mask."""
+    return cv.findContours(mask, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)[0]
+
+
+def findMaskBlobs(mask, min_area=30, denoise=0):
+    """Finds all blobs of a mask with cv.connectedComponentsWithStats().
+
+    Returns the (stats, centroids) rows of the components with an area of
+    at least min_area, background excluded. With `denoise` > 1 the mask is
+    first opened with an elliptic kernel of that size to remove speckles.
+    Areas are pixel counts, so they are slightly larger than contour areas."""
+    if denoise > 1:
+        kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (denoise, denoise))
+        mask = cv.morphologyEx(mask, cv.MORPH_OPEN, kernel)
+    _, _, stats, centroids = cv.connectedComponentsWithStats(mask, connectivity=8)
+    keep = stats[1:, cv.CC_STAT_AREA] >= min_area
+    return stats[1:][keep], centroids[1:][keep]
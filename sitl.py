@@ -0,0 +1,273 @@
+import sys
+import mmap
+import math
+import time
+import signal
+import argparse
+import posix_ipc
+import numpy as np
+import cv2 as cv
+import config
+from config import *
+from conversions import const3, const4, intToDegPerSecArray, ThrottleCRSFtoRPMArray, ThrustArray
+from channels import ChannelReader, SHM_SIZE
+from virtcam import VirtualCameraWriter, SEGMENT_SIZE, SHAPE
+from keys import sendKeys
+
+"""
+Software in the loop simulator, a stand-in for the ELRS bridge and the
+external simulator of --virt mode.
+
+    python3 sitl.py [--lockstep --speed 0] [--keys "1:w,60:s" --cycle 70]
+    python3 main.py --virt --sim-clock --headless --keys mqueue
+
+It reads the channels DroneCtrl writes to /myshm, turns them back into
+angles and thrust, moves a simulated drone and renders the colored targets
+of SITL_TARGETS into /myVirtCamMem. With --lockstep it waits until
+DroneCtrl has answered each frame, so with --speed 0 and --sim-clock the
+simulation runs as fast as DroneCtrl can process frames, and key presses
+can be scripted in simulated time to repeat takeoffs and landings.
+"""
+
+
+def channelsToCommands(channels):
+    """Inverts control(), one row of 16 channels per drone. Returns (armed,
+    yaw rate, pitch, roll, thrust): the yaw rate in degrees per second, the
+    pitch and roll angles in degrees (ANGLE mode) and the thrust of all four
+    motors in newtons."""
+    channels = np.atleast_2d(np.asarray(channels, dtype=np.int64))
+    armed = channels[:, 6] > 0 # AUX1
+    # Like intToCRSF(), but rounded: CRSFtoInt() truncates, so truncating
+    # again would turn most CRSF values into the one below
+    rpm = ThrottleCRSFtoRPMArray(np.rint(channels[:, 3] * const3 + const4))
+    thrust = np.where(armed, 4 * ThrustArray(np.maximum(rpm, 0)), 0)
+    return (armed, intToDegPerSecArray(channels[:, 0]), intToDegPerSecArray(channels[:, 1]),
+            intToDegPerSecArray(channels[:, 2]), thrust)
+
+
+class QuadModel:
+    """Point mass quadcopter flown in ANGLE mode, vectorized over `n` drones.
+
+    The flight controller tilts the drone to the commanded pitch and roll
+    with a first order lag and turns it at the commanded yaw rate. The
+    thrust points along the tilted body, so the accelerations are the ones
+    control() asked for, scaled so that the drone hovers at
+    SITL_HOVER_OFFSET like in the simulator the offset was tuned on. x is
+    forward, y left and z up, the heading is counterclockwise from x, so a
+    positive yaw rate turns right like followTarget() expects."""
+
+    def __init__(self, n=1, hoverOffset=SITL_HOVER_OFFSET, attitudeTime=SITL_ATTITUDE_TIME_CONSTANT, drag=SITL_DRAG):
+        self.thrustScale = G / (G + hoverOffset * MAX_VERTICAL_ACCELERATION)
+        self.attitudeTime = attitudeTime
+        self.drag = drag
+        self.time = 0.0
+
+        self.position = np.zeros((n, 3))
+        self.velocity = np.zeros((n, 3))
+        self.heading = np.zeros(n) # degrees
+        self.pitch = np.zeros(n) # degrees, positive tilts the nose down
+        self.roll = np.zeros(n) # degrees, positive tilts the left side down
+        self.grounded = np.ones(n, dtype=bool)
+
+        self.takeoffs = np.zeros(n, dtype=np.int64)
+        self.touchdowns = np.zeros(n, dtype=np.int64)
+        self.hardLandings = np.zeros(n, dtype=np.int64)
+        self.maxTouchdownSpeed = np.zeros(n)
+        self.lastTouchdownSpeed = np.zeros(n)
+        self.maxHeight = np.zeros(n)
+
+    def step(self, commands, dt):
+        """Advances the simulation by `dt` seconds with the commands of
+        channelsToCommands()."""
+        armed, yawRate, pitch, roll, thrust = commands
+        blend = min(dt / self.attitudeTime, 1) if self.attitudeTime > 0 else 1
+        self.pitch += (pitch - self.pitch) * blend
+        self.roll += (roll - self.roll) * blend
+        self.heading -= np.where(self.grounded, 0, yawRate) * dt
+
+        tanPitch = np.tan(np.radians(self.pitch))
+        tanRoll = np.tan(np.radians(self.roll))
+        lift = self.thrustScale * thrust / MASS / np.sqrt(1 + tanPitch**2 + tanRoll**2)
+        forward, left = lift * tanPitch, lift * tanRoll
+        heading = np.radians(self.heading)
+        cos, sin = np.cos(heading), np.sin(heading)
+        acceleration = np.stack([forward * cos - left * sin, forward * sin + left * cos, lift - G], axis=1)
+        acceleration -= self.drag * self.velocity
+
+        self.velocity += acceleration * dt
+        self.position += self.velocity * dt
+        self.time += dt
+
+        ground = self.position[:, 2] <= 0
+        touchdown = ground & ~self.grounded
+        if touchdown.any():
+            speed = -self.velocity[:, 2]
+            self.touchdowns += touchdown
+            self.hardLandings += touchdown & (speed > SITL_HARD_LANDING_SPEED)
+            self.maxTouchdownSpeed = np.where(touchdown, np.maximum(self.maxTouchdownSpeed, speed), self.maxTouchdownSpeed)
+            self.lastTouchdownSpeed = np.where(touchdown, speed, self.lastTouchdownSpeed)
+        self.takeoffs += ~ground & self.grounded
+        self.position[ground, 2] = 0
+        self.velocity[ground] = 0
+        self.grounded = ground
+        np.maximum(self.maxHeight, self.position[:, 2], out=self.maxHeight)
+
+
+def _bgr(color):
+    """The BGR color in the middle of an HSV range of config.py."""
+    (h1, s1, v1), (h2, s2, v2) = color
+    hue = ((h1 + h2 + (180 if h1 > h2 else 0)) // 2) % 180 # RED wraps around 0
+    pixel = np.uint8([[[hue, (s1 + s2) // 2, (v1 + v2) // 2]]])
+    return tuple(int(v) for v in cv.cvtColor(pixel, cv.COLOR_HSV2BGR)[0, 0])
+
+
+def project(points, position, heading, pitch, roll, focal, center):
+    """Returns (u, v, depth) of world `points` in the image of the camera of
+    drones at `position`, with their attitude in degrees. The camera looks
+    forward and is fixed to the drone. Broadcasts, so it works for many
+    points seen by one drone or one point seen by many drones."""
+    d = np.asarray(points, dtype=np.float64) - position
+    dx, dy, dz = d[..., 0], d[..., 1], d[..., 2]
+    heading, pitch, roll = np.radians(heading), np.radians(pitch), np.radians(roll)
+    ahead = dx * np.cos(heading) + dy * np.sin(heading)
+    left = -dx * np.sin(heading) + dy * np.cos(heading)
+    depth = ahead * np.cos(pitch) - dz * np.sin(pitch)
+    up = ahead * np.sin(pitch) + dz * np.cos(pitch)
+    left, up = left * np.cos(roll) - up * np.sin(roll), left * np.sin(roll) + up * np.cos(roll)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return center[0] - focal * left / depth, center[1] - focal * up / depth, depth
+
+
+class TargetRenderer:
+    """Renders the targets as seen by a forward looking camera fixed to
+    the drone, as flat colored discs on a gray background."""
+
+    def __init__(self, targets=SITL_TARGETS, shape=SHAPE, fov=SITL_CAMERA_FOV):
+        self.positions = np.array([position for _, position, _ in targets], dtype=np.float64).reshape(-1, 3)
+        self.radii = np.array([radius for _, _, radius in targets], dtype=np.float64)
+        self.colors = [_bgr(getattr(config, name)) for name, _, _ in targets]
+        self.focal = shape[1] / 2 / math.tan(math.radians(fov) / 2)
+        self.center = (shape[1] / 2, shape[0] / 2)
+        self.background = np.full(shape, 96, dtype=np.uint8)
+        self.image = np.empty(shape, dtype=np.uint8)
+
+    def render(self, position, heading, pitch, roll):
+        """Returns the BGR frame of a drone at `position` with the given
+        attitude in degrees."""
+        np.copyto(self.image, self.background)
+        u, v, depth = project(self.positions, position, heading, pitch, roll, self.focal, self.center)
+
+        limit = 4 * self.image.shape[1] # Keeps the coordinates of targets right in front of the camera drawable
+        u, v = np.clip(u, -limit, limit), np.clip(v, -limit, limit)
+        for i in np.argsort(-depth): # The farthest first
+            if depth[i] < 0.05:
+                continue
+            radius = int(min(self.focal * self.radii[i] / depth[i], limit))
+            cv.circle(self.image, (int(u[i]), int(v[i])), max(radius, 1), self.colors[i], -1)
+        return self.image
+
+
+class KeyScript:
+    """Keys to press at given simulated times, repeated every `cycle`
+    seconds if it is not 0."""
+
+    def __init__(self, text="", cycle=0):
+        self.events = []
+        for event in filter(None, text.split(",")):
+            at, key = event.split(":")
+            self.events.append((float(at), key))
+        self.events.sort()
+        self.cycle = cycle
+        self.offset = 0.0
+        self.next = 0
+
+    def due(self, now):
+        """Returns the keys whose time has come."""
+        keys = ""
+        while self.next < len(self.events) and self.events[self.next][0] + self.offset <= now:
+            keys += self.events[self.next][1]
+            self.next += 1
+            if self.next == len(self.events) and self.cycle > 0:
+                self.next = 0
+                self.offset += self.cycle
+        return keys
+
+
+def _map(name, size):
+    memory = posix_ipc.SharedMemory(name, posix_ipc.O_CREAT, size=size)
+    mapping = mmap.mmap(memory.fd, size)
+    memory.close_fd()
+    return mapping
+
+
+def report(model, frames, started):
+    elapsed = time.perf_counter() - started
+    x, y, z = model.position[0]
+    print(f"{model.time:.1f} s simulated in {elapsed:.1f} s ({model.time / elapsed if elapsed else 0:.1f}x real time), {frames} frames, "
+          f"position ({x:.2f}, {y:.2f}, {z:.2f}) m, max height {model.maxHeight[0]:.2f} m, {model.takeoffs[0]} takeoffs, "
+          f"{model.touchdowns[0]} touchdowns, {model.hardLandings[0]} hard (max {model.maxTouchdownSpeed[0]:.2f} m/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulates a drone for DroneCtrl's --virt mode.")
+    parser.add_argument("--fps", help="camera frames per simulated second", type=float, default=SITL_CAMERA_FPS)
+    parser.add_argument("--physics-rate", help="physics steps per simulated second", type=float, default=SITL_PHYSICS_RATE)
+    parser.add_argument("--speed", help="simulated seconds per real second, 0 for as fast as possible", type=float, default=1)
+    parser.add_argument("--lockstep", help="wait until DroneCtrl has answered each frame", action="store_true")
+    parser.add_argument("--duration", help="stop after this many simulated seconds, 0 runs until Ctrl+C", type=float, default=0)
+    parser.add_argument("--keys", help='keys to send to DroneCtrl (--keys mqueue) at simulated times, as "seconds:key,..."', default="")
+    parser.add_argument("--cycle", help="repeat the keys every this many simulated seconds", type=float, default=0)
+    parser.add_argument("--report", help="print the statistics every this many simulated seconds", type=float, default=60)
+    args = parser.parse_args()
+    if args.speed == 0 and not args.lockstep:
+        print("--speed 0 needs --lockstep, DroneCtrl could not keep up")
+        sys.exit(1)
+
+    channels = ChannelReader(_map(CHANNELS_SHM_NAME, SHM_SIZE))
+    camera = VirtualCameraWriter(_map(VIRTUAL_CAMERA_SHM_NAME, SEGMENT_SIZE))
+    model = QuadModel()
+    renderer = TargetRenderer()
+    script = KeyScript(args.keys, args.cycle)
+    substeps = max(1, round(args.physics_rate / args.fps))
+    dt = 1 / args.fps / substeps
+
+    frames = 0
+    nextReport = args.report
+    started = time.perf_counter()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while not args.duration or model.time < args.duration:
+            commands = channelsToCommands(channels.read()[2])
+            for _ in range(substeps):
+                model.step(commands, dt)
+            keys = script.due(model.time)
+            if keys:
+                sendKeys(KEY_QUEUE_NAME, keys)
+
+            camera.write(renderer.render(model.position[0], model.heading[0], model.pitch[0], model.roll[0]), model.time)
+            frames += 1
+            if args.lockstep:
+                if frames == 1:
+                    print("Waiting for DroneCtrl...")
+                while not camera.handled():
+                    time.sleep(0.0001)
+            elif args.speed > 0:
+                delay = started + model.time / args.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if args.report and model.time >= nextReport:
+                report(model, frames, started)
+                nextReport += args.report
+    except KeyboardInterrupt:
+        pass
+    finally:
+        report(model, frames, started)
+        for name in (CHANNELS_SHM_NAME, VIRTUAL_CAMERA_SHM_NAME):
+            try:
+                posix_ipc.unlink_shared_memory(name)
+            except posix_ipc.ExistentialError:
+                pass
+
+if __name__ == "__main__":
+    main()
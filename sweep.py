@@ -0,0 +1,240 @@
+import os
+import csv
+import math
+import time
+import itertools
+import argparse
+import multiprocessing
+import numpy as np
+from tabulate import tabulate
+from config import *
+from config import Config as c
+from control import controlArray
+from takeoff import takeoffAccelerations, CalculateLanding
+from sitl import QuadModel, channelsToCommands, project
+
+"""
+Parameter sweeps on simulated drones.
+
+    python3 sweep.py VERTICAL_ACCELERATION_OFFSET=0.45:0.6:16 STABILIZED_HOVER_STEP_DURATION=0.5,1,1.5,2
+
+Every combination of the given values is one drone of the sitl.py model,
+all stepped together with NumPy through the same commands control() would
+send. Each drone takes off, hovers for SWEEP_HOVER_TIME, holds a
+stabilized hover on the SWEEP_TARGET for SWEEP_STABILIZE_TIME and lands,
+like pressing w, a and s. The drones are split across a process pool.
+"""
+
+# The parameters that can be swept and their values in config.py
+PARAMETERS = {
+    "VERTICAL_ACCELERATION_OFFSET": VERTICAL_ACCELERATION_OFFSET,
+    "TAKEOFF_HEIGHT": TAKEOFF_HEIGHT,
+    "TAKEOFF_TIME": TAKEOFF_TIME,
+    "STABILIZED_HOVER_STEP_ACCELERATION_Y": STABILIZED_HOVER_STEP_ACCELERATION_Y,
+    "STABILIZED_HOVER_STEP_ACCELERATION_Z": STABILIZED_HOVER_STEP_ACCELERATION_Z,
+    "STABILIZED_HOVER_STEP_DURATION": STABILIZED_HOVER_STEP_DURATION,
+    "STABILIZED_HOVER_DEADZONE": STABILIZED_HOVER_DEADZONE,
+}
+
+# Metric -> description, in the order of the results
+METRICS = {
+    "takeoff overshoot %": "highest point above TAKEOFF_HEIGHT during the takeoff and hover",
+    "takeoff settle s": "time from the start until the height stays within SWEEP_SETTLE_BAND, empty if it never does",
+    "hover drift m/s": "distance moved during the hover per second",
+    "hover climb m/s": "height change during the hover per second, negative when it sinks",
+    "stabilize overshoot px": "how far the target went past the center of the image",
+    "stabilize settle s": "time until the target stays within STABILIZED_HOVER_DEADZONE, empty if it never does",
+    "early touchdowns": "touchdowns before landing",
+    "landing speed m/s": "touchdown speed of the landing",
+}
+
+TAKING_OFF, HOVERING, STABILIZING, LANDING, LANDED = range(5)
+
+
+def _getAccel(center, mid, accel, deadzone):
+    """Array version of control._getAccel()."""
+    return np.where(np.abs(center - mid) < deadzone, 0, np.where(center > mid, -accel, accel))
+
+
+def simulate(params, fps=SITL_CAMERA_FPS, physicsRate=SITL_PHYSICS_RATE,
+             hoverTime=SWEEP_HOVER_TIME, stabilizeTime=SWEEP_STABILIZE_TIME):
+    """Flies one drone per parameter set. `params` maps names of PARAMETERS
+    to arrays of the same length, the others keep their config.py values.
+    Returns the METRICS as arrays, NaN where a metric does not apply."""
+    n = len(next(iter(params.values())))
+    p = {name: np.broadcast_to(np.asarray(params.get(name, default), dtype=np.float64), (n,))
+         for name, default in PARAMETERS.items()}
+    height, deadzone = p["TAKEOFF_HEIGHT"], p["STABILIZED_HOVER_DEADZONE"]
+    duration, halfDuration = p["STABILIZED_HOVER_STEP_DURATION"], p["STABILIZED_HOVER_STEP_DURATION"] / 2
+    takeoffTime = p["TAKEOFF_TIME"]
+    accel1, accel2 = takeoffAccelerations(height, takeoffTime)
+    CalculateLanding()
+
+    model = QuadModel(n)
+    dt = 1 / fps
+    substeps = max(1, round(physicsRate / fps))
+    focal = CAM_WIDTH / 2 / math.tan(math.radians(SITL_CAMERA_FOV) / 2)
+    center = (CAM_WIDTHD2, CAM_HEIGHTD2)
+    channels = np.zeros((n, 16), dtype=np.int64)
+    channels[:, 6] = 1 # Armed
+
+    phase = np.full(n, TAKING_OFF)
+    phaseTime, takeoffCnt, landingCnt, timer = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
+    accelX, accelZ = np.zeros(n), np.zeros(n)
+    forward, sideways, vertical, angle = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
+
+    nan = np.full(n, np.nan)
+    maxHeight, lastUnsettled, hoverStart = np.zeros(n), np.zeros(n), np.zeros((n, 3))
+    signU, signV, overshoot, lastOffTarget = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
+    metrics = {name: nan.copy() for name in METRICS}
+
+    elapsed = 0.0
+    # Drones still in the air after Land() fall with the throttle at zero
+    timeout = takeoffTime.max() + hoverTime + stabilizeTime + LANDING_TIME + 5
+    while ((phase != LANDED) | ~model.grounded).any() and elapsed < timeout:
+        position = model.position
+        u, v, depth = project(SWEEP_TARGET, position, model.heading, model.pitch, model.roll, focal, center)
+        seen = (depth > 0.05) & (u >= 0) & (u < CAM_WIDTH) & (v >= 0) & (v < CAM_HEIGHT)
+
+        # The keys, a after the hover and s after the stabilized hover
+        toStabilize = (phase == HOVERING) & (phaseTime >= hoverTime)
+        if toStabilize.any():
+            metrics["hover drift m/s"][toStabilize] = np.linalg.norm(position - hoverStart, axis=1)[toStabilize] / hoverTime
+            metrics["hover climb m/s"][toStabilize] = (position[:, 2] - hoverStart[:, 2])[toStabilize] / hoverTime
+            settled = np.abs(position[:, 2] - height) <= SWEEP_SETTLE_BAND * height
+            metrics["takeoff settle s"][toStabilize & settled] = lastUnsettled[toStabilize & settled]
+            metrics["takeoff overshoot %"][toStabilize] = (100 * np.maximum(maxHeight - height, 0) / height)[toStabilize]
+            signU[toStabilize], signV[toStabilize] = np.sign(u - center[0])[toStabilize], np.sign(v - center[1])[toStabilize]
+            phase[toStabilize], phaseTime[toStabilize], timer[toStabilize] = STABILIZING, 0, 0
+        toLand = (phase == STABILIZING) & (phaseTime >= stabilizeTime)
+        if toLand.any():
+            onTarget = seen & (np.abs(u - center[0]) <= deadzone) & (np.abs(v - center[1]) <= deadzone)
+            metrics["stabilize settle s"][toLand & onTarget] = lastOffTarget[toLand & onTarget]
+            metrics["stabilize overshoot px"][toLand] = overshoot[toLand]
+            metrics["early touchdowns"][toLand] = model.touchdowns[toLand]
+            phase[toLand], phaseTime[toLand], landingCnt[toLand] = LANDING, 0, 0
+
+        # Update(): Hover() and Stabilize()
+        flying = (phase == HOVERING) | (phase == STABILIZING)
+        forward[flying], sideways[flying], vertical[flying], angle[flying] = 0, 0, 0, 0
+        stabilizing = phase == STABILIZING
+        fresh = stabilizing & seen & ((timer == 0) | (timer >= duration))
+        first = stabilizing & seen & ~fresh & (timer < halfDuration)
+        second = stabilizing & seen & ~fresh & (timer >= halfDuration)
+        timer[fresh & (timer >= duration)] = 0.0001
+        accelZ = np.where(fresh, _getAccel(v, CAM_HEIGHTD2, p["STABILIZED_HOVER_STEP_ACCELERATION_Z"] / 2, deadzone), accelZ)
+        accelX = np.where(fresh, _getAccel(u, CAM_WIDTHD2, p["STABILIZED_HOVER_STEP_ACCELERATION_Y"] / 2, deadzone), accelX)
+        sideways = np.where(first, accelX, np.where(second, -accelX, sideways))
+        vertical = np.where(first, accelZ, np.where(second, -accelZ, vertical))
+        timer[stabilizing] += dt
+
+        # TakeoffLandingTick(): Takeoff(), Land() and ZeroThrottle()
+        takingOff = phase == TAKING_OFF
+        forward[takingOff], angle[takingOff] = 0, 0
+        vertical = np.where(takingOff, np.where(takeoffCnt < 2 * takeoffTime / 3, accel1, accel2), vertical)
+        tookOff = takingOff & (takeoffCnt >= takeoffTime)
+        vertical[tookOff] = 0
+        hoverStart[tookOff] = position[tookOff]
+        phase[tookOff], phaseTime[tookOff] = HOVERING, 0
+        takeoffCnt[takingOff] += dt
+
+        landing = phase == LANDING
+        forward[landing], sideways[landing], angle[landing] = 0, 0, 0
+        vertical = np.where(landing, np.where(landingCnt < LANDING_TIME1, c.landingAccel1, c.landingAccel2), vertical)
+        landed = landing & (landingCnt >= LANDING_TIME)
+        phase[landed] = LANDED
+        vertical[phase == LANDED] = -10
+        landingCnt[landing] += dt
+
+        channels[:, 0], channels[:, 1], channels[:, 2], channels[:, 3] = controlArray(forward, sideways, vertical, angle, p["VERTICAL_ACCELERATION_OFFSET"])
+        commands = channelsToCommands(channels)
+        for _ in range(substeps):
+            model.step(commands, dt / substeps)
+        elapsed += dt
+        phaseTime += dt
+
+        # Metrics of the tick
+        takeoffOrHover = (phase == TAKING_OFF) | (phase == HOVERING)
+        np.maximum(maxHeight, np.where(takeoffOrHover, model.position[:, 2], 0), out=maxHeight)
+        unsettled = takeoffOrHover & (np.abs(model.position[:, 2] - height) > SWEEP_SETTLE_BAND * height)
+        lastUnsettled[unsettled] = elapsed
+        offTarget = stabilizing & ~(seen & (np.abs(u - center[0]) <= deadzone) & (np.abs(v - center[1]) <= deadzone))
+        lastOffTarget[offTarget] = phaseTime[offTarget]
+        past = np.maximum(-signU * (u - center[0]), -signV * (v - center[1]))
+        np.maximum(overshoot, np.where(stabilizing & seen, past, 0), out=overshoot)
+
+    touchedDown = model.touchdowns > metrics["early touchdowns"]
+    metrics["landing speed m/s"][touchedDown] = model.lastTouchdownSpeed[touchedDown]
+    return metrics
+
+
+def parseValues(text):
+    """Parses "a,b,c" or "start:stop:count" into values."""
+    if ":" in text:
+        start, stop, count = text.split(":")
+        return np.linspace(float(start), float(stop), int(count))
+    return np.array([float(value) for value in text.split(",")])
+
+
+def _simulateChunk(args):
+    params, settings = args
+    return simulate(params, **settings)
+
+
+def sweep(grid, workers=0, **settings):
+    """Simulates every combination of the values in `grid`, a dict of
+    parameter name -> values, on `workers` processes (0 for one per CPU).
+    Returns (params, metrics), both dicts of arrays with one element per
+    combination."""
+    names = list(grid)
+    combinations = np.array(list(itertools.product(*(grid[name] for name in names))), dtype=np.float64).reshape(-1, len(names))
+    params = {name: combinations[:, i] for i, name in enumerate(names)}
+    workers = workers or os.cpu_count()
+    chunks = [chunk for chunk in np.array_split(np.arange(len(combinations)), workers) if len(chunk)]
+    jobs = [({name: values[chunk] for name, values in params.items()}, settings) for chunk in chunks]
+    if len(jobs) == 1:
+        results = [_simulateChunk(jobs[0])]
+    else:
+        with multiprocessing.get_context("fork").Pool(len(jobs)) as pool:
+            results = pool.map(_simulateChunk, jobs)
+    metrics = {name: np.concatenate([result[name] for result in results]) for name in METRICS}
+    return params, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweeps control parameters on simulated drones.",
+                                     epilog=f"Parameters: {', '.join(PARAMETERS)}. Metrics: "
+                                            + "; ".join(f"{name}: {description}" for name, description in METRICS.items()))
+    parser.add_argument("grid", nargs="+", help='NAME=a,b,c or NAME=start:stop:count')
+    parser.add_argument("--workers", help="processes, 0 for one per CPU", type=int, default=SWEEP_WORKERS)
+    parser.add_argument("--fps", help="control loop rate in simulated Hz", type=float, default=SITL_CAMERA_FPS)
+    parser.add_argument("--hover", help="seconds of hover", type=float, default=SWEEP_HOVER_TIME)
+    parser.add_argument("--stabilize", help="seconds of stabilized hover", type=float, default=SWEEP_STABILIZE_TIME)
+    parser.add_argument("--sort", help="metric to sort the results by, closest to 0 first", choices=list(METRICS), default="stabilize settle s")
+    parser.add_argument("--top", help="rows to print", type=int, default=20)
+    parser.add_argument("--csv", help="write every result to this CSV file")
+    args = parser.parse_args()
+
+    grid = {}
+    for spec in args.grid:
+        name, _, values = spec.partition("=")
+        if name not in PARAMETERS or not values:
+            parser.error(f"{spec} is not NAME=values with a NAME of {', '.join(PARAMETERS)}")
+        grid[name] = parseValues(values)
+
+    start = time.perf_counter()
+    params, metrics = sweep(grid, args.workers, fps=args.fps, hoverTime=args.hover, stabilizeTime=args.stabilize)
+    count = len(next(iter(metrics.values())))
+    print(f"Simulated {count} drones in {time.perf_counter() - start:.1f} s")
+
+    order = np.argsort(np.abs(metrics[args.sort]), kind="stable") # NaN last
+    rows = [[f"{params[name][i]:g}" for name in params] + [f"{metrics[name][i]:.3g}" for name in METRICS] for i in order]
+    print(tabulate(rows[:args.top], headers=list(params) + list(METRICS), tablefmt="simple"))
+    if args.csv:
+        with open(args.csv, "w", newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(list(params) + list(METRICS))
+            writer.writerows([params[name][i] for name in params] + [metrics[name][i] for name in METRICS] for i in order)
+
+if __name__ == "__main__":
+    main()
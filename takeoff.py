@@ -2,11 +2,10 @@ from config import *
 from config import Config as c
 from utils import clamp
 from conversions import *
-from basic import safeCall
 import logging
+import numpy as np
 
 
-@safeCall
 def CalculateTakeoff(h: float, t: float):
     """Calculates the thrust needed for the drone to take off to a given
     height `h` in a given time `t`.""" 
@@ -51,7 +50,14 @@ def CalculateTakeoff(h: float, t: float):
 
     logging.debug("\n")
 
-@safeCall
+def takeoffAccelerations(h, t):
+    """The two vertical accelerations of CalculateTakeoff() for heights `h`
+    and times `t`, which can be NumPy arrays, e.g. one per simulated drone."""
+    a1 = (3 * h)/(t ** 2)
+    u1 = (2 * a1 * t)/3
+    a2 = -3 * u1/t
+    return np.clip(a1/MAX_VERTICAL_ACCELERATION, -1, 1), np.clip(a2/MAX_VERTICAL_ACCELERATION, -1, 1)
+
 def Takeoff(takeoffStage: int):
     if takeoffStage == 1:
         logging.debug(f"\tSetting acceleration to {c.takeoffAccel1} for takeoff stage 1...")
@@ -67,7 +73,6 @@ def Takeoff(takeoffStage: int):
         logging.debug(f"\tInvalid takeoff stage {takeoffStage}. Must be 1 or 2")
 
 # TODO: Actually calculate landing thrust
-@safeCall
 def CalculateLanding():
     """Calculates the thrust needed for the drone to land relatively slowly.""" 
 
@@ -81,7 +86,6 @@ def CalculateLanding():
     logging.debug(f"Landing Acceleration 2: {c.landingAccel2}")
     logging.debug("\n")
 
-@safeCall
 def Land(landingStage: int):
     if landingStage == 1:
         logging.debug(f"\tSetting acceleration to {c.landingAccel1} for landing stage 1...")
@@ -0,0 +1,102 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from tabulate import tabulate
+from config import *
+from config import Config as c
+from conversions import intToCRSF, intToDegPerSec
+from flightlog import RECORD_DTYPE, FlightLogWriter, CsvLogWriter
+
+
+def _int16(value):
+    return -32768 if value < -32768 else 32767 if value > 32767 else value
+
+
+class TelemetryLogger(threading.Thread):
+    """Takes the debug table and the blackbox log off the control thread.
+
+    push() copies the current state into a preallocated ring buffer and
+    returns. A background thread wakes up every TELEMETRY_INTERVAL seconds,
+    appends all new records to the log in one batch and redraws the
+    debug table from the newest one. If the thread falls so far behind that
+    the ring is full, new records are dropped and counted in `dropped`."""
+
+    def __init__(self, path, binary=False, capacity=TELEMETRY_BUFFER_SIZE):
+        super().__init__(name="TelemetryLogger", daemon=True)
+        self.path = path
+        self.binary = binary # Binary flight log instead of CSV
+        self.ring = np.zeros(capacity, dtype=RECORD_DTYPE)
+        self.head = 0 # Records pushed
+        self.tail = 0 # Records written
+        self.dropped = 0
+        self.debugInfo = ""
+        self.running = True
+
+        # To turn monotonic record times into wall clock timestamps
+        self.wallOffset = time.time() - time.monotonic()
+
+    def push(self):
+        """Records the current state. Called from the control thread."""
+        if self.head - self.tail >= len(self.ring):
+            self.dropped += 1
+            return
+        self.ring[self.head % len(self.ring)] = (
+            time.monotonic(), c.state, c.flyingState,
+            _int16(c.yaw), _int16(c.pitch), _int16(c.roll), _int16(c.throttle),
+            c.Theta, c.Phi, c.angle, c.a_x, c.a_y, c.a_z, c.w_y, c.Thrust, c.dt,
+        )
+        self.debugInfo = c.debugInfo
+        self.head += 1
+
+    def run(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        Writer = FlightLogWriter if self.binary else CsvLogWriter
+        writer = Writer(self.path, self.wallOffset)
+        while self.running:
+            time.sleep(TELEMETRY_INTERVAL)
+            self.flush(writer)
+        self.flush(writer)
+        writer.close()
+
+    def flush(self, writer):
+        """Writes every pending record and renders the newest one."""
+        head = self.head
+        if head == self.tail:
+            return
+        indices = np.arange(self.tail, head) % len(self.ring)
+        records = self.ring[indices] # A copy, so push() may reuse the slots
+        self.tail = head
+
+        writer.append(records)
+        writer.flush()
+        if not c.headless:
+            self.render(records[-1])
+
+    def render(self, record):
+        yaw, pitch, roll, throttle = (int(record[name]) for name in ("yaw", "pitch", "roll", "throttle"))
+        headers = ["States", "", "CRSF", "int16", "Angle", "", "Accelerations"]
+        table_data = [
+            [State(record["state"]).name,             "Yaw",      intToCRSF(yaw),      yaw,      round(intToDegPerSec(float(record["w_y"])), 4), "x:", record["a_x"]],
+            [FlyingState(record["flyingState"]).name, "Pitch",    intToCRSF(pitch),    pitch,    round(float(record["pitchAngle"]), 4),       "y:", record["a_y"]],
+            ["",                                      "Roll",     intToCRSF(roll),     roll,     round(float(record["rollAngle"]), 4),        "z:", record["a_z"]],
+            ["",                                      "Throttle", intToCRSF(throttle), throttle, round(float(record["angle"]), 4),            "w:", record["w_y"]],
+        ]
+
+        print("\033c", end="")
+
+        print(tabulate(table_data, headers=headers, tablefmt="fancy_grid", numalign="left", stralign="right"))
+
+        print(self.debugInfo)
+        if c.profiler is not None:
+            print(c.profiler.table())
+        if self.dropped:
+            print(f"Telemetry records dropped: {self.dropped}")
+
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join(2 * TELEMETRY_INTERVAL + 1)
+        if self.dropped:
+            logging.debug(f"\tTelemetry records dropped: {self.dropped}")
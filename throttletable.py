@@ -0,0 +1,103 @@
+import os
+import math
+import hashlib
+import logging
+import numpy as np
+from config import *
+from conversions import *
+
+# Part of the cache key, bump it when _thrustToCRSF() or _throttleToThrust()
+# change in a way the constants of conversions.py do not capture
+CURVE_VERSION = 1
+
+
+def _thrustToCRSF(thrust):
+    """ThrustToRPM() and RPMtoThrottleCRSF() without the truncations to
+    integers. Replace this with a measured curve to recalibrate, the cost
+    of a lookup stays the same."""
+    return RPM_TO_CRSF_SLOPE * (np.sqrt(thrust) * const2) + RPM_TO_CRSF_OFFSET
+
+def _throttleToThrust(throttle):
+    """The inverse of the motor model, int16 throttle -> thrust per motor."""
+    rpm = ((throttle * const3 + const4) - RPM_TO_CRSF_OFFSET) / RPM_TO_CRSF_SLOPE
+    return ThrustArray(np.maximum(rpm, 0))
+
+
+class ThrottleTable:
+    """Interpolated lookup tables between the thrust of a motor and the
+    int16 throttle, built from the conversion functions.
+
+    The thrust table covers 0 to 1.5 times the thrust per motor needed for
+    the maximum accelerations in config.py and stores CRSF values before
+    they are truncated, so a lookup only differs from the analytic chain
+    (ThrustToRPM -> RPMtoThrottleCRSF -> CRSFtoInt) where the error moves a
+    value across an integer CRSF step, one step being 65.5 int16 counts.
+    Above 1% of the range, `maxError` is the largest CRSF error and
+    `mismatch` the fraction of throttles that differ from the chain. Below
+    it sqrt() is too steep to interpolate, but the motors barely spin
+    there. With 4096 points the error is about 0.001 CRSF and about 1% of
+    throttles are one CRSF step higher than the chain's, which truncates
+    the RPM to an integer before converting it.
+
+    A lookup is not faster than the analytic chain (about 1.9 against
+    1.7 us per conversion), so the table is off by default. It only pays
+    off when _thrustToCRSF() is replaced with a measured curve that is
+    more expensive to evaluate. Tables are cached on disk, keyed by the
+    model constants, CURVE_VERSION and the resolution."""
+
+    def __init__(self, size=THROTTLE_LUT_SIZE):
+        maxThrust = 1.5 * MASS * math.sqrt(MAX_FORWARD_ACCELERATION**2 + MAX_SIDEWAYS_ACCELERATION**2
+                                           + ((1 + VERTICAL_ACCELERATION_OFFSET) * MAX_VERTICAL_ACCELERATION + G)**2) / 4
+        self.maxThrust = maxThrust
+        self.thrustStep = maxThrust / (size - 1)
+        self.throttleStep = 65535 / (size - 1)
+
+        # Keyed by the model constants and the curve version, so a recalibration rebuilds it
+        model = (PI, RHO, PROP_DIAMETER, PROP_PITCH, RPM_TO_CRSF_SLOPE, RPM_TO_CRSF_OFFSET, CRSF_MIN, CRSF_MAX)
+        key = hashlib.sha1(repr((model, CURVE_VERSION, MASS, G, maxThrust, size)).encode()).hexdigest()[:16]
+        path = os.path.join(THROTTLE_LUT_CACHE_DIR, f"throttlelut-{key}.npz")
+        if os.path.exists(path):
+            with np.load(path) as cached:
+                self.crsf, self.thrust = cached["crsf"], cached["thrust"]
+                self.maxError, self.mismatch = float(cached["maxError"]), float(cached["mismatch"])
+            logging.debug(f"\tLoaded throttle lookup table {path}")
+        else:
+            logging.debug("\tBuilding throttle lookup table...")
+            self.crsf = _thrustToCRSF(np.arange(size) * self.thrustStep)
+            self.thrust = _throttleToThrust(np.arange(size) * self.throttleStep - 32768)
+            self.maxError, self.mismatch = self._measureError()
+            os.makedirs(THROTTLE_LUT_CACHE_DIR, exist_ok=True)
+            np.savez(path, crsf=self.crsf, thrust=self.thrust, maxError=self.maxError, mismatch=self.mismatch)
+            logging.debug(f"\tThrottle lookup table saved to {path}")
+
+        # Plain lists are faster than arrays to index from Python
+        self._crsf = self.crsf.tolist()
+        self._crsfSlope = np.diff(self.crsf).tolist()
+        self._thrust = self.thrust.tolist()
+        self._thrustSlope = np.diff(self.thrust).tolist()
+        self._last = size - 2
+        logging.debug(f"\tThrottle lookup table max error: {self.maxError:.4f} CRSF, {100 * self.mismatch:.3f}% of throttles differ")
+
+    def _measureError(self):
+        thrust = np.linspace(0.01 * self.maxThrust, self.maxThrust, 16 * len(self.crsf))
+        interpolated = np.interp(thrust, np.arange(len(self.crsf)) * self.thrustStep, self.crsf)
+        chain = RPMtoThrottleCRSFArray(ThrustToRPMArray(thrust))
+        mismatch = np.count_nonzero(chain != interpolated.astype(np.int64)) / len(thrust)
+        return float(np.abs(_thrustToCRSF(thrust) - interpolated).max()), mismatch
+
+    def throttle(self, thrust):
+        """Returns (throttleCRSF, throttle int16) for the thrust of a motor."""
+        x = thrust / self.thrustStep
+        i = int(x)
+        if i > self._last:
+            i = self._last # Extrapolate
+        elif i < 0:
+            i = 0
+        throttleCRSF = int(self._crsf[i] + (x - i) * self._crsfSlope[i])
+        return throttleCRSF, CRSFtoInt(throttleCRSF)
+
+    def thrustOf(self, throttle):
+        """Returns the thrust of a motor for an int16 throttle."""
+        x = (throttle + 32768) / self.throttleStep
+        i = min(max(int(x), 0), self._last)
+        return self._thrust[i] + (x - i) * self._thrustSlope[i]
@@ -0,0 +1,97 @@
+from config import *
+from config import Config as c
+from utils import findContour
+
+
+class RoiTracker:
+    """Tracks the largest blob of the given colors by only searching a
+    window around where it was last seen.
+
+    The window is ROI_SCALE times the size of the last contour, never
+    smaller than ROI_MIN_SIZE, and is widened in the direction the target
+    is moving. After ROI_MAX_MISSES frames without a detection the tracker
+    goes back to searching the whole frame."""
+
+    def __init__(self, colors):
+        self.colors = colors
+        self.reset()
+
+    def reset(self):
+        self.center = None # (row, column) of the last detection
+        self.size = (0, 0) # (height, width) of the last contour
+        self.velocity = (0, 0) # (rows, columns) per frame
+        self.misses = 0
+
+    def window(self, shape):
+        """Returns the (top, bottom, left, right) search window."""
+        halfH = max(ROI_MIN_SIZE, ROI_SCALE * self.size[0]) / 2 + abs(self.velocity[0]) * ROI_VELOCITY_GAIN
+        halfW = max(ROI_MIN_SIZE, ROI_SCALE * self.size[1]) / 2 + abs(self.velocity[1]) * ROI_VELOCITY_GAIN
+        # Widen the window on each consecutive miss
+        halfH *= 1 + self.misses
+        halfW *= 1 + self.misses
+        row = self.center[0] + self.velocity[0]
+        column = self.center[1] + self.velocity[1]
+
+        top = max(0, int(row - halfH))
+        bottom = min(shape[0], int(row + halfH) + 1)
+        left = max(0, int(column - halfW))
+        right = min(shape[1], int(column + halfW) + 1)
+        return top, bottom, left, right
+
+    def find(self, image):
+        """Same as findContour(image, *colors), returns the blob in full
+        frame coordinates or None."""
+        if self.center is None:
+            blob = findContour(image, *self.colors)
+        else:
+            top, bottom, left, right = self.window(image.shape)
+            # The blobs of every color are in window coordinates, the
+            # returned one among them
+            found = []
+            blob = findContour(image[top:bottom, left:right], *self.colors, overlays=found)
+            for overlay in found:
+                overlay.translate(left, top)
+            c.overlays.extend(found)
+
+        if blob is None or blob.center is None:
+            self.misses += 1
+            if self.center is not None and self.misses >= ROI_MAX_MISSES:
+                self.reset()
+            return None
+
+        if self.center is not None:
+            self.velocity = (blob.center[0] - self.center[0], blob.center[1] - self.center[1])
+        self.center = blob.center
+        self.size = (blob.bbox[3], blob.bbox[2])
+        self.misses = 0
+        return blob
+
+
+def findTarget(*colors):
+    """Finds the largest blob of the given colors in c.image, using the
+    ROI tracker when ROI tracking is enabled. Returns a Blob or None.
+    With vision workers, this is the newest result of the workers.
+
+    If getFrame() returned the same frame as last time, the result for
+    that frame is returned again without running the detection. The vision
+    workers are still asked for their newest result."""
+    if not c.newFrame and c.vision is None and colors in c.lastTargets:
+        blob, overlays = c.lastTargets[colors]
+        c.overlays.extend(overlays)
+        return blob
+
+    start = len(c.overlays)
+    blob = _findTarget(colors)
+    c.lastTargets[colors] = (blob, c.overlays[start:])
+    return blob
+
+def _findTarget(colors):
+    if c.vision is not None:
+        return c.vision.find(c.image, colors)
+    if not c.roiTracking:
+        return findContour(c.image, *colors)
+
+    tracker = c.roiTrackers.get(colors)
+    if tracker is None:
+        tracker = c.roiTrackers[colors] = RoiTracker(colors)
+    return tracker.find(c.image)
@@ -1,11 +1,13 @@
 from enum import Enum
+import time
 import cv2 as cv
 from nptyping import NDArray
 from typing import *
 import numpy as np
 from config import *
 from config import Config as c
-from basic import safeCall
+from segmentation import Blob, getSegmenter, findMaskContours, findMaskBlobs
+from basic import enterStage
 
 """
 The code below is licensed under the MIT License.
@@ -39,7 +41,6 @@ class ColorBGR(Enum):
     white = (255, 255, 255)
     brown = (0, 63, 127)
 
-@safeCall
 def clamp(value: float, min: float, max: float) -> float:
     """
     Clamps a value between a minimum and maximum value.
@@ -65,7 +66,6 @@ def clamp(value: float, min: float, max: float) -> float:
     """
     return min if value < min else max if value > max else value
 
-@safeCall
 def remap_range(
     val: float,
     old_min: float,
@@ -116,7 +116,6 @@ def remap_range(
 
     return new_val
 
-@safeCall
 def find_contours(
     color_image: Any,
     hsv_lower: Tuple[int, int, int],
@@ -190,7 +189,6 @@ def find_contours(
     # Find and return a list of all contours of this mask
     return cv.findContours(mask, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)[0]
 
-@safeCall
 def get_largest_contour(
     contours: List[NDArray], min_area: int = 30
 ) -> Optional[NDArray]:
@@ -221,14 +219,15 @@ def get_largest_contour(
     if len(contours) == 0:
         return None
 
-    # Find and return the largest contour if it is larger than min_area
-    greatest_contour = max(contours, key=cv.contourArea)
-    if cv.contourArea(greatest_contour) < min_area:
+    # Find and return the largest contour if it is larger than min_area,
+    # computing every area only once
+    areas = [cv.contourArea(contour) for contour in contours]
+    greatest = max(range(len(areas)), key=areas.__getitem__)
+    if areas[greatest] < min_area:
         return None
 
-    return greatest_contour
+    return contours[greatest]
 
-@safeCall
 def draw_contour(
     color_image: Any,
     contour: NDArray,
@@ -264,7 +263,6 @@ def draw_contour(
 
     cv.drawContours(color_image, [contour], 0, color, 3)
 
-@safeCall
 def draw_circle(
     color_image: Any,
     center: Tuple[int, int],
@@ -312,7 +310,6 @@ def draw_circle(
     # cv.circle expects the center in (column, row) format
     cv.circle(color_image, (center[1], center[0]), radius, color, -1)
 
-@safeCall
 def get_contour_center(contour: NDArray) -> Optional[Tuple[int, int]]:
     """
     Finds the center of a contour from an image.
@@ -350,7 +347,6 @@ def get_contour_center(contour: NDArray) -> Optional[Tuple[int, int]]:
     center_column = round(M["m10"] / M["m00"])
     return (center_row, center_column)
 
-@safeCall
 def get_contour_area(contour: NDArray) -> float:
     """
     Finds the area of a contour from an image.
@@ -379,32 +375,94 @@ def get_contour_area(contour: NDArray) -> float:
 The code above is licensed under the MIT License.
 """
 
-@safeCall
-def findContour(image, *colors):
-    contours = []
+def findLargestBlob(mask, color=None, min_area=30, backend=None):
+    """Finds the largest blob of a mask with an area of at least min_area.
+
+    `backend` is either "contours" (cv.findContours) or "components"
+    (cv.connectedComponentsWithStats, which gives blobs without a contour).
+    On clean masks "components" is about 10x slower (1.7 ms against 0.15 ms
+    per 640x480 mask), but its cost does not grow with the number of blobs:
+    it is only worth using on speckled masks with thousands of tiny blobs
+    (2 ms against 31 ms at 5% noise). Defaults to c.blobBackend."""
+    if (backend or c.blobBackend) == "components":
+        stats, centroids = findMaskBlobs(mask, min_area, c.blobDenoise)
+        if len(stats) == 0:
+            return None
+        largest = int(np.argmax(stats[:, cv.CC_STAT_AREA]))
+        return Blob.fromStats(stats[largest], centroids[largest], color)
+
+    contour = get_largest_contour(findMaskContours(mask), min_area)
+    if contour is None:
+        return None
+    return Blob(contour, color)
+
+def _refineBlob(image, blob, scale, backend):
+    """Redoes the detection of a blob found on a downscaled image on the
+    full resolution image, in a window around it."""
+    x, y, w, h = (v * scale for v in blob.bbox)
+    top, left = max(0, y - 2 * scale), max(0, x - 2 * scale)
+    bottom, right = min(image.shape[0], y + h + 2 * scale), min(image.shape[1], x + w + 2 * scale)
+    mask = getSegmenter((blob.color,)).masks(image[top:bottom, left:right], (blob.color,))[blob.color]
+    refined = findLargestBlob(mask, blob.color, backend=backend)
+    if refined is None:
+        return blob.rescale(scale)
+    return refined.translate(left, top)
+
+def findContour(image, *colors, backend=None, overlays=None):
+    """Finds the largest blob of the given colors, or None if there is
+    none. The image is left untouched, the largest blob of each color is
+    appended to `overlays` (c.overlays by default) for the preview to draw.
+
+    With c.detectionLevels > 0 the detection runs on an image pyramid level
+    that many times half the size. Blobs are scaled back (and optionally
+    refined) so the results are always in full resolution coordinates.
+    `backend` selects how blobs are extracted, see findLargestBlob()."""
+    previous = enterStage("detection")
+    scale = 1 << c.detectionLevels
+    small = image
+    for _ in range(c.detectionLevels):
+        small = cv.pyrDown(small)
+
+    if overlays is None:
+        overlays = c.overlays
+    masks = getSegmenter(colors).masks(small, colors)
+    largest = None
     for color in colors:
-        contour = get_largest_contour(find_contours(image, color[0], color[1]))
-        if contour is not None:
-            contours.append(contour)
-            draw_contour(image, contour, color[1])
-            center = get_contour_center(contour)
-            draw_circle(image, center)
-    if len(contours) > 0:
-        largest_contour = max(contours, key=get_contour_area)
-        largest_center = get_contour_center(largest_contour)
-        return largest_contour, largest_center
-    else:
-        return None, None
-
-@safeCall
-def getFrame():
+        blob = findLargestBlob(masks[color], color, max(1, 30 // scale**2), backend)
+        if blob is None:
+            continue
+        if scale > 1:
+            if c.detectionRefine:
+                blob = _refineBlob(image, blob, scale, backend)
+            else:
+                blob.rescale(scale)
+
+        overlays.append(blob)
+        if largest is None or blob.area > largest.area:
+            largest = blob
+    enterStage(previous)
+    return largest
+
+def getFrame(timeout=0):
+    """Updates c.image with the newest camera frame. With the capture
+    thread enabled this never blocks, `timeout` only applies to the
+    first frame. c.newFrame is False when the camera had no new frame and
+    c.image is the same frame as last time."""
     if c.virtual:
-        c.virtCamMapFile.seek(0)
-        data = c.virtCamMapFile.read(640 * 480 * 3)
-        img = np.frombuffer(data, dtype=np.uint8)
-        c.image = np.copy(np.flipud(img.reshape((480, 640, 3))))
-        c.image[:, :, [0, 2]] = c.image[:, :, [2, 0]]
-        return (c.image is not None)
+        c.image, c.newFrame = c.virtCam.read()
+        if c.simClock and not c.newFrame:
+            # No simulated time passes without a frame, wait for one instead of spinning
+            deadline = time.perf_counter() + SIM_CLOCK_FRAME_WAIT
+            while not c.newFrame and time.perf_counter() < deadline:
+                time.sleep(VIRTUAL_CAMERA_RETRY_DELAY)
+                c.image, c.newFrame = c.virtCam.read()
+        return True
+    elif c.capThread is not None:
+        ret, c.image, c.frameTime, c.droppedFrames = c.capThread.read(timeout)
+        c.newFrame = c.capThread.frameSeq != c.frameSeq
+        c.frameSeq = c.capThread.frameSeq
+        return ret
     else:
         ret, c.image = c.cap.read()
+        c.newFrame = True
         return ret
\ No newline at end of file
@@ -0,0 +1,109 @@
+import time
+import struct
+import numpy as np
+import cv2 as cv
+from config import *
+
+"""
+Virtual camera shared memory.
+
+The simulator writes each frame bottom-up in RGB at the start of the
+segment. A header after the frame tells the readers about it:
+
+    seq      u64  Frame sequence number, 0 if the simulator does not
+                  write the header (every read is then a new frame)
+    simTime  f64  Simulation time of the frame in seconds
+    writing  u32  1 while the frame is being written
+
+A simulator sets writing to 1, writes the frame and then writes the whole
+header with the next sequence number and writing at 0.
+
+DroneCtrl writes the sequence number of the frame it has sent the
+commands for after the header:
+
+    done     u64  Written after every Update(), so a simulator that waits
+                  for it before the next frame runs in lockstep
+"""
+
+HEADER = struct.Struct("<QdI")
+HEADER_OFFSET = VIRTUAL_IMAGE_SIZE
+DONE = struct.Struct("<Q")
+DONE_OFFSET = HEADER_OFFSET + 24
+SEGMENT_SIZE = VIRTUAL_IMAGE_SIZE + 64
+SHAPE = (VIRTUAL_IMAGE_SIZE_Y, VIRTUAL_IMAGE_SIZE_X, VIRTUAL_IMAGE_SIZE_Z)
+
+
+class VirtualCameraReader:
+    """Reads frames from the virtual camera segment.
+
+    read() only copies a frame when the sequence number has changed, and
+    retries a frame that was written to while it was copied. Each new frame
+    is flipped and converted to BGR once, into a back buffer that only
+    becomes the front buffer once the copy is known to be whole.
+    cv.flip() and cv.cvtColor() do that about 15 times faster than copying
+    a reversed view of the segment."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.frame = np.ndarray(SHAPE, dtype=np.uint8, buffer=buffer)
+        self.front = np.zeros(SHAPE, dtype=np.uint8)
+        self.back = np.zeros(SHAPE, dtype=np.uint8)
+
+        self.seq = 0
+        self.simTime = 0.0
+        self.torn = 0 # Copies thrown away because the frame changed during them
+        self.duplicates = 0 # Reads that found no new frame
+
+    def read(self):
+        """Returns (frame, new). If there is no new frame, or no whole one
+        after VIRTUAL_CAMERA_RETRIES attempts, the previous frame is
+        returned with new set to False."""
+        seq, simTime, writing = HEADER.unpack_from(self.buffer, HEADER_OFFSET)
+        # Without the header seq stays 0 and every frame is new
+        if seq != 0 and seq == self.seq:
+            self.duplicates += 1
+            return self.front, False
+
+        for attempt in range(VIRTUAL_CAMERA_RETRIES):
+            if attempt:
+                time.sleep(VIRTUAL_CAMERA_RETRY_DELAY)
+                seq, simTime, writing = HEADER.unpack_from(self.buffer, HEADER_OFFSET)
+            if writing:
+                self.torn += 1
+                continue
+            cv.flip(self.frame, 0, dst=self.back)
+            cv.cvtColor(self.back, cv.COLOR_RGB2BGR, dst=self.back)
+            if HEADER.unpack_from(self.buffer, HEADER_OFFSET) != (seq, simTime, 0):
+                self.torn += 1
+                continue
+            self.front, self.back = self.back, self.front
+            self.seq = seq
+            self.simTime = simTime
+            return self.front, True
+        return self.front, False
+
+    def done(self):
+        """Tells the simulator that the current frame has been handled."""
+        DONE.pack_into(self.buffer, DONE_OFFSET, self.seq)
+
+
+class VirtualCameraWriter:
+    """Writes frames to the virtual camera segment the way a simulator
+    should. `image` is a BGR frame, top-down like a camera image."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.frame = np.ndarray(SHAPE, dtype=np.uint8, buffer=buffer)
+        self.rgb = np.empty(SHAPE, dtype=np.uint8)
+        self.seq = HEADER.unpack_from(buffer, HEADER_OFFSET)[0]
+
+    def write(self, image, simTime):
+        struct.pack_into("<I", self.buffer, HEADER_OFFSET + 16, 1)
+        cv.cvtColor(image, cv.COLOR_BGR2RGB, dst=self.rgb)
+        cv.flip(self.rgb, 0, dst=self.frame)
+        self.seq += 1
+        HEADER.pack_into(self.buffer, HEADER_OFFSET, self.seq, simTime, 0)
+
+    def handled(self):
+        """True once DroneCtrl has sent the commands for the last frame."""
+        return DONE.unpack_from(self.buffer, DONE_OFFSET)[0] == self.seq
@@ -0,0 +1,292 @@
+import os
+import mmap
+import time
+import signal
+import logging
+import traceback
+import multiprocessing
+import posix_ipc
+import numpy as np
+from config import *
+from config import Config as c
+from segmentation import Blob
+from tracking import findTarget
+
+"""
+Multi-process vision.
+
+The control process copies each frame into a ring of slots in a posix_ipc
+shared memory segment and wakes the workers with a semaphore. The first
+idle worker claims the newest frame, older unclaimed frames are skipped,
+runs tracking.findTarget() on its own copy and publishes the blobs it
+found in its result slot, guarded by a sequence counter that is odd while
+the slot is being written. The control process never waits for a worker,
+it uses the newest result of any worker.
+"""
+
+HEADER_DTYPE = np.dtype([
+    ("running", "<u4"),
+    ("workers", "<u4"),
+    ("latest", "<u8"), # Sequence number of the newest frame
+    ("claimed", "<u8"), # Sequence number of the newest frame a worker took
+], align=True)
+
+SLOT_DTYPE = np.dtype([
+    ("seq", "<u8"), # 0 while the frame is being written
+    ("time", "<f8"), # time.perf_counter() of the submission, CLOCK_MONOTONIC
+    ("colors", "<u4"), # Bitmask of SEGMENTATION_COLORS to search for
+], align=True)
+
+BLOB_DTYPE = np.dtype([
+    ("color", "u1"), # Index in SEGMENTATION_COLORS
+    ("hasCenter", "u1"),
+    ("points", "<u2"), # Contour points, 0 for blobs without a contour
+    ("area", "<f8"),
+    ("center", "<i4", 2), # (row, column)
+    ("bbox", "<i4", 4), # (x, y, width, height)
+    ("contour", "<i4", (MAX_CONTOUR_POINTS, 2)),
+], align=True)
+
+RESULT_DTYPE = np.dtype([
+    ("seq", "<u8"), # Odd while the result is being written
+    ("frameSeq", "<u8"),
+    ("frameTime", "<f8"),
+    ("colors", "<u4"),
+    ("count", "<u4"),
+    ("target", "<i4"), # Index of the blob findTarget() returned, -1 for None
+    ("blobs", BLOB_DTYPE, (len(SEGMENTATION_COLORS),)),
+], align=True)
+
+
+def _colorMask(colors):
+    mask = 0
+    for color in colors:
+        assert color in SEGMENTATION_COLORS, f"{color} is not one of SEGMENTATION_COLORS"
+        mask |= 1 << SEGMENTATION_COLORS.index(color)
+    return mask
+
+def _maskColors(mask):
+    return tuple(color for i, color in enumerate(SEGMENTATION_COLORS) if mask & (1 << i))
+
+
+class _Layout:
+    """Numpy views of the shared memory segment."""
+
+    def __init__(self, buffer, shape, ringSize, workers):
+        offset = 0
+        def view(dtype, count):
+            nonlocal offset
+            array = np.ndarray((count,), dtype=dtype, buffer=buffer, offset=offset)
+            offset += -(-array.nbytes // 64) * 64 # Cache line aligned
+            return array
+
+        self.header = view(HEADER_DTYPE, 1)
+        self.slots = view(SLOT_DTYPE, ringSize)
+        self.results = view(RESULT_DTYPE, workers)
+        frameSize = int(np.prod(shape))
+        self.frames = view(np.uint8, ringSize * frameSize).reshape((ringSize,) + tuple(shape))
+
+    @staticmethod
+    def size(shape, ringSize, workers):
+        align = lambda n: -(-n // 64) * 64
+        return (align(HEADER_DTYPE.itemsize) + align(SLOT_DTYPE.itemsize * ringSize)
+                + align(RESULT_DTYPE.itemsize * workers) + align(ringSize * int(np.prod(shape))))
+
+
+def _writeResult(result, frameSeq, frameTime, colors, overlays, target):
+    result["seq"] += 1
+    result["frameSeq"] = frameSeq
+    result["frameTime"] = frameTime
+    result["colors"] = colors
+    result["count"] = len(overlays)
+    result["target"] = -1
+    blobs = result["blobs"][0]
+    for i, blob in enumerate(overlays[:len(blobs)]):
+        record = blobs[i:i + 1]
+        record["color"] = SEGMENTATION_COLORS.index(blob.color)
+        record["area"] = blob.area
+        record["hasCenter"] = blob.center is not None
+        record["center"] = blob.center if blob.center is not None else (0, 0)
+        record["bbox"] = blob.bbox
+        if blob.contour is not None:
+            # Only used for drawing, so long contours are thinned out
+            points = blob.contour.reshape(-1, 2)
+            points = points[::-(-len(points) // MAX_CONTOUR_POINTS)]
+            record["points"] = len(points)
+            record["contour"][0, :len(points)] = points
+        else:
+            record["points"] = 0
+        if blob is target:
+            result["target"] = i
+    result["seq"] += 1
+
+def _blobFromRecord(record):
+    blob = Blob.__new__(Blob)
+    points = int(record["points"])
+    blob.contour = record["contour"][:points].reshape(-1, 1, 2).copy() if points else None
+    blob.color = SEGMENTATION_COLORS[record["color"]]
+    blob.area = float(record["area"])
+    blob.center = (int(record["center"][0]), int(record["center"][1])) if record["hasCenter"] else None
+    row, column = blob.center if blob.center is not None else (0, 0)
+    blob.moments = {"m00": blob.area, "m10": blob.area * column, "m01": blob.area * row}
+    blob.bbox = tuple(int(v) for v in record["bbox"])
+    return blob
+
+
+def _worker(index, name, shape, ringSize, workers, parent):
+    """Runs in a forked worker process until the pool is stopped or the
+    control process dies."""
+    # Only the control process may talk to the drone or handle signals
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    c.mapFile = c.channels = None
+    c.vision = None
+    c.newFrame = True
+
+    memory = posix_ipc.SharedMemory(name)
+    buffer = mmap.mmap(memory.fd, memory.size)
+    memory.close_fd()
+    layout = _Layout(buffer, shape, ringSize, workers)
+    header = layout.header
+    result = layout.results[index:index + 1]
+    frames = posix_ipc.Semaphore(name + "-frames")
+    claim = posix_ipc.Semaphore(name + "-claim")
+    frame = np.empty(shape, dtype=np.uint8)
+
+    while header["running"][0] and os.getppid() == parent:
+        try:
+            frames.acquire(0.1)
+        except posix_ipc.BusyError:
+            continue
+
+        with claim:
+            seq = int(header["latest"][0])
+            if seq <= header["claimed"][0]:
+                continue
+            header["claimed"] = seq
+
+        slot = seq % ringSize
+        if layout.slots["seq"][slot] != seq:
+            continue # Already overwritten
+        np.copyto(frame, layout.frames[slot])
+        frameTime = float(layout.slots["time"][slot])
+        colors = int(layout.slots["colors"][slot])
+        if layout.slots["seq"][slot] != seq:
+            continue # Overwritten while it was copied
+
+        c.image = frame
+        c.overlays = []
+        try:
+            target = findTarget(*_maskColors(colors))
+        except Exception:
+            # The control process notices the missing results
+            print(f"Vision worker {index} failed:\n{traceback.format_exc()}")
+            break
+        _writeResult(result, seq, frameTime, colors, c.overlays, target)
+
+    del layout, header, result # The views must go before the mapping
+    buffer.close()
+
+
+class VisionPool:
+    """Runs the detection of findTarget() in worker processes.
+
+    find() hands the frame to the workers and returns the newest result
+    for the same colors without waiting, so a slow frame never delays the
+    control loop. The result may be for an older frame. Results older than
+    VISION_MAX_AGE seconds are ignored, and if every worker has died find()
+    raises, which stops the program like any other failure."""
+
+    def __init__(self, shape, workers=1, ringSize=VISION_RING_SIZE, name=VISION_SHM_NAME):
+        self.shape = tuple(shape)
+        self.ringSize = ringSize
+        self.name = f"{name}-{os.getpid()}"
+        self.memory = posix_ipc.SharedMemory(self.name, posix_ipc.O_CREX, size=_Layout.size(shape, ringSize, workers))
+        self.buffer = mmap.mmap(self.memory.fd, self.memory.size)
+        self.memory.close_fd()
+        self.layout = _Layout(self.buffer, shape, ringSize, workers)
+        self.layout.header["running"] = 1
+        self.layout.header["workers"] = workers
+        self.frames = posix_ipc.Semaphore(self.name + "-frames", posix_ipc.O_CREX)
+        self.claim = posix_ipc.Semaphore(self.name + "-claim", posix_ipc.O_CREX, initial_value=1)
+
+        self.seq = 0
+        self.resultSeqs = [0] * workers
+        self.cache = {} # colors -> (frameSeq, frameTime, overlays, target)
+        self.submitted = 0
+        self.results = 0
+
+        ctx = multiprocessing.get_context("fork")
+        self.processes = [ctx.Process(target=_worker, args=(i, self.name, self.shape, ringSize, workers, os.getpid()),
+                                      name=f"VisionWorker{i}", daemon=True) for i in range(workers)]
+        for process in self.processes:
+            process.start()
+        logging.debug(f"\tStarted {workers} vision workers")
+
+    def submit(self, image, colors):
+        """Copies a frame into the ring and wakes the workers."""
+        self.seq += 1
+        slot = self.seq % self.ringSize
+        slots = self.layout.slots
+        slots["seq"][slot] = 0
+        np.copyto(self.layout.frames[slot], image)
+        slots["time"][slot] = time.perf_counter()
+        slots["colors"][slot] = _colorMask(colors)
+        slots["seq"][slot] = self.seq
+        self.layout.header["latest"] = self.seq
+        self.frames.release()
+        self.submitted += 1
+
+    def _collect(self):
+        """Reads the results that changed since the last call."""
+        results = self.layout.results
+        for i in range(len(results)):
+            seq = int(results["seq"][i])
+            if seq == self.resultSeqs[i] or seq & 1:
+                continue
+            result = results[i:i + 1].copy()[0]
+            if results["seq"][i] != seq:
+                continue # Torn, read it next time
+            self.resultSeqs[i] = seq
+            colors = int(result["colors"])
+            cached = self.cache.get(colors)
+            if cached is not None and cached[0] >= result["frameSeq"]:
+                continue # A newer frame was done first by another worker
+            overlays = [_blobFromRecord(record) for record in result["blobs"][:result["count"]]]
+            target = overlays[result["target"]] if result["target"] >= 0 else None
+            self.cache[colors] = (int(result["frameSeq"]), float(result["frameTime"]), overlays, target)
+            self.results += 1
+
+    def find(self, image, colors):
+        """Submits the frame, unless it is the same frame as last time, and
+        returns the target of the newest result for `colors`, a Blob or
+        None. Its overlays are added to c.overlays."""
+        if c.newFrame:
+            self.submit(image, colors)
+        self._collect()
+        cached = self.cache.get(_colorMask(colors))
+        if cached is None or time.perf_counter() - cached[1] > VISION_MAX_AGE:
+            if not any(process.is_alive() for process in self.processes):
+                raise RuntimeError("All vision workers stopped")
+            return None
+        c.overlays.extend(cached[2])
+        return cached[3]
+
+    def stop(self):
+        if not hasattr(self, "layout"):
+            return # Already stopped
+        self.layout.header["running"] = 0
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        logging.debug(f"\tVision: {self.submitted} frames submitted, {self.results} results")
+        del self.layout
+        self.buffer.close()
+        for unlink in (lambda: posix_ipc.unlink_shared_memory(self.name),
+                       lambda: posix_ipc.unlink_semaphore(self.name + "-frames"),
+                       lambda: posix_ipc.unlink_semaphore(self.name + "-claim")):
+            try:
+                unlink()
+            except posix_ipc.ExistentialError:
+                pass